@@ -34,9 +34,9 @@ class Pig(Animal):
 
     def on_buy(self) -> ActionFunc:
         def refund_gold(state: GameState):
-            print('This should refund some gold but is not implemented yet')
+            state.gold += self.level
 
-        return ActionFunc(refund_gold, "Do nothing", self)
+        return ActionFunc(refund_gold, f"Refund {self.level} gold", self)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,306 @@
+from __future__ import annotations
+from typing import Dict, Type, Tuple, Optional, Sequence, List, Union, Callable
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from functools import lru_cache
+import math
+import random
+from copy import deepcopy
+
+import data_structures
+from animals import *
+
+WIN: int = 1
+DRAW: int = 0
+LOSS: int = -1
+
+SPECIES: Dict[str, Type[Animal]] = {cls.__name__: cls for cls in Animal.__subclasses__()}
+""" Every Animal defined in animals.py, keyed by class name """
+
+AnimalSpec = Tuple[str, int, int, int, int, int, int]
+""" (species, attack, health, temp_attack, temp_health, rank, level) """
+
+TeamSpec = Tuple[AnimalSpec, ...]
+""" Plain-data version of a Team that can be hashed, pickled or sent as JSON. Empty slots are dropped """
+
+Matchup = Tuple[TeamSpec, TeamSpec, Optional[int]]
+""" (player team, opponent team, seed) """
+
+
+def encode_animal(animal: Animal) -> AnimalSpec:
+    return (animal.__class__.__name__, animal.attack, animal.health, animal.temp_attack, animal.temp_health,
+            animal.rank, animal.level)
+
+
+def decode_animal(spec: Sequence) -> Animal:
+    species, attack, health, temp_attack, temp_health, rank, level = spec
+    if species not in SPECIES:
+        raise ValueError(f"Unknown species {species}")
+    return SPECIES[species](attack=attack, health=health, temp_attack=temp_attack, temp_health=temp_health,
+                            rank=rank, level=level)
+
+
+def encode_team(team: TeamInitType) -> TeamSpec:
+    """ :returns the TeamSpec of `team`, which may be a Team or any Iterable of Animals and Nones """
+    return tuple(encode_animal(a) for a in team if a is not None)
+
+
+def decode_team(spec: Sequence[Sequence]) -> Team:
+    """ :returns a new Team built from a TeamSpec. Also accepts the lists produced by round-tripping through JSON """
+    return Team([decode_animal(a) for a in spec])
+
+
+def as_team_spec(team: Union[TeamInitType, Sequence[Sequence]]) -> TeamSpec:
+    """ :returns `team` as a TeamSpec, whether it is a Team, an Iterable of Animals or already a (JSON) TeamSpec """
+    if isinstance(team, Team):
+        return encode_team(team)
+    if isinstance(team, tuple) and all(type(a) is tuple for a in team):  # already a TeamSpec
+        return team
+    team = list(team)
+    if any(isinstance(a, Animal) for a in team):
+        return encode_team(team)
+    return tuple(tuple(a) for a in team)
+
+
+@contextmanager
+def quiet():
+    """ Temporarily set data_structures.LOGGING_LEVEL to 0 so that batch runs don't print every action """
+    old = data_structures.LOGGING_LEVEL
+    data_structures.LOGGING_LEVEL = 0
+    try:
+        yield
+    finally:
+        data_structures.LOGGING_LEVEL = old
+
+
+@contextmanager
+def using_rng(rng):
+    """ Temporarily make the engine draw its random choices from `rng` (see data_structures.rng) """
+    old = data_structures.rng
+    data_structures.rng = rng
+    try:
+        yield rng
+    finally:
+        data_structures.rng = old
+
+
+class CountingRNG:
+    """
+    Passes random choices through to another rng (e.g. a random.Random), counting them. Draws with only one possible
+    result (e.g. randint(1, 1), or sampling 1 of 1 friends) aren't counted, since nothing random happens
+
+    Attributes
+    ----------
+    forced: List[tuple]
+        the draws with only one possible result, as ('randint', a, b) or ('sample', population size, n), so that they
+        can be made again with `replay_forced`
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.draws = 0
+        self.forced: List[tuple] = []
+
+    def randint(self, a: int, b: int) -> int:
+        if b > a:
+            self.draws += 1
+        else:
+            self.forced.append(('randint', a, b))
+        return self.rng.randint(a, b)
+
+    def sample(self, population: Sequence, n: int) -> list:
+        if math.perm(len(population), n) > 1:
+            self.draws += 1
+        else:
+            self.forced.append(('sample', len(population), n))
+        return self.rng.sample(population, n)
+
+
+def replay_forced(rng, forced: Sequence[tuple]):
+    """ Make the same calls as `forced` (see CountingRNG) on `rng`, so it ends up in the same state """
+    for kind, a, b in forced:
+        if kind == 'randint':
+            rng.randint(a, b)
+        else:
+            rng.sample(range(a), b)
+
+
+class SubgameCache:
+    """
+    Battle engine that memoizes the outcome of the subgames a battle passes through.
+
+    Between attacks the resolution queue is empty, so what happens for the rest of a battle only depends on the two
+    boards. Each time a battle reaches a board pair that has been seen before, the rest of the battle is skipped and
+    the cached outcome and final boards are used instead. Only subgames that finished without any random choice are
+    stored, since any other subgame could have ended differently. Draws with a single possible result (e.g. an Ant
+    fainting with one friend left) don't count as random choices; they are stored with the subgame and made again on
+    a hit, so the rng is left in the same state as by GameState.do_combat.
+
+    The cache is an LRU bounded to `maxsize` entries and is meant to be shared by every battle in a process (see
+    `subgame_cache`). Call an instance with a combat GameState like GameState.do_combat.
+
+    Attributes
+    ----------
+    hit_depths: Counter
+        number of hits by how many attacks into the battle they happened (0 is right after start of combat)
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._cache: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.hit_depths: Counter = Counter()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = self.misses = 0
+        self.hit_depths.clear()
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {'size': len(self._cache), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0., 'hit_depths': dict(self.hit_depths)}
+
+    def __call__(self, state: GameState, max_attacks: int = 1000) -> int:
+        counter = CountingRNG(data_structures.rng)
+        visited: List[Tuple[tuple, int, int]] = []
+        with using_rng(counter):
+            state.start_combat()
+            depth = 0
+            while len(state.player_team) > 0 and len(state.opponent_team) > 0:
+                key = (encode_team(state.player_team), encode_team(state.opponent_team))
+                if (cached := self._cache.get(key)) is not None:
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    self.hit_depths[depth] += 1
+                    outcome, player, opponent, forced = cached
+                    replay_forced(counter.rng, forced)
+                    counter.forced.extend(forced)  # so they are stored with the earlier subgames of this battle too
+                    # reload the existing Teams so that anyone holding them (e.g. a BattlePool) sees the final boards
+                    state.player_team.reset(decode_team(player).get_friends())
+                    state.opponent_team.reset(decode_team(opponent).get_friends())
+                    break
+                self.misses += 1
+                if depth >= max_attacks:
+                    raise Exception(f"Combat did not complete after {max_attacks} attacks. Possible infinite loop?")
+                visited.append((key, counter.draws, len(counter.forced)))
+                state.do_attack()
+                depth += 1
+            else:
+                outcome = battle_outcome(state.player_team, state.opponent_team)
+
+        player, opponent = encode_team(state.player_team), encode_team(state.opponent_team)
+        for key, draws, forced in visited:
+            if draws == counter.draws:  # nothing random happened from this subgame to the end of the battle
+                self._cache[key] = (outcome, player, opponent, tuple(counter.forced[forced:]))
+                if len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return outcome
+
+
+subgame_cache = SubgameCache()
+""" The SubgameCache shared by every battle run in this process with memoize=True """
+
+_FRONT_TRIGGERS = ('take_damage', 'on_hurt', 'on_faint', 'before_attack')
+""" Callbacks that can fire for the Animals at the front of each team during an attack """
+
+_BACK_TRIGGERS = ('on_friend_ahead_attack', 'on_friend_summoned')
+""" Callbacks that can fire for Animals further back during an attack """
+
+
+@lru_cache(maxsize=None)
+def _overrides(cls: Type[Animal], names: Tuple[str, ...]) -> bool:
+    return any(getattr(cls, name) is not getattr(Animal, name) for name in names)
+
+
+def is_ability_free(animal: Animal) -> bool:
+    """ :returns whether none of `animal`'s callbacks can do anything while it attacks or is attacked """
+    return not _overrides(animal.__class__, _FRONT_TRIGGERS + _BACK_TRIGGERS)
+
+
+def closed_form_combat(state: GameState, max_attacks: int = 1000) -> int:
+    """
+    Battle engine equivalent to GameState.do_combat that skips through stretches of pure arithmetic.
+
+    While both front Animals are ability free (and nobody further back reacts to attacks), the next Animal to faint
+    is found directly: each front takes ceil(health / enemy attack) hits to faint, and both take the smaller number of
+    hits. That is applied as a single stat change instead of stepping through take_damage, the resolution queue and
+    Team.validate for every attack. As soon as an Animal with an ability reaches the front, attacks are resolved one
+    by one again.
+
+    Intermediate steps are not resolved, so a GameState.step_callback doesn't see them, but the final boards are the
+    same and the same random choices are made (one per attack between Animals with tied attack), so the rng is left
+    in the same state as by GameState.do_combat.
+    """
+    state.start_combat()
+    skip_ok = not any(_overrides(a.__class__, _BACK_TRIGGERS)
+                      for a in state.player_team.get_friends() + state.opponent_team.get_friends())
+    num_attacks = 0
+    while len(state.player_team) > 0 and len(state.opponent_team) > 0:
+        if num_attacks >= max_attacks:
+            raise Exception(f"Combat did not complete after {max_attacks} attacks. Possible infinite loop?")
+        p, o = state.player_team[0], state.opponent_team[0]
+        # do_attack deals base attack as damage, so that is what is used here too
+        if skip_ok and p.attack >= 0 and o.attack >= 0 and (p.attack > 0 or o.attack > 0) and \
+                not _overrides(p.__class__, _FRONT_TRIGGERS) and not _overrides(o.__class__, _FRONT_TRIGGERS):
+            hits = min(-(-p.current_health // o.attack) if o.attack > 0 else max_attacks,
+                       -(-o.current_health // p.attack) if p.attack > 0 else max_attacks,
+                       max_attacks - num_attacks)
+            if p.current_attack == o.current_attack:
+                for _ in range(hits):  # the tie break in get_priority
+                    data_structures.rng.randint(0, 1)
+            p.temp_health -= hits * o.attack
+            o.temp_health -= hits * p.attack
+            state.player_team.validate()
+            state.opponent_team.validate()
+            num_attacks += hits
+        else:
+            state.do_attack()
+            num_attacks += 1
+
+    return battle_outcome(state.player_team, state.opponent_team)
+
+
+def run_battle(player: Union[Team, Sequence], opponent: Union[Team, Sequence], seed: Optional[int] = None,
+               rng=None, memoize: bool = False, engine: Optional[Callable[[GameState], int]] = None) -> int:
+    """
+    Simulate a full battle between two teams without modifying them. Teams may be given as Teams or TeamSpecs.
+
+    :param seed: if given, the global `random` module is seeded with it first so the battle is reproducible
+    :param rng: if given, the engine makes its random choices with this instead of data_structures.rng
+    :param memoize: short-circuit subgames already seen in this process, using `subgame_cache`
+    :param engine: battle engine to resolve the battle with, e.g. closed_form_combat. Defaults to
+     GameState.do_combat, or `subgame_cache` if `memoize` is set
+    :returns WIN, DRAW or LOSS from the point of view of `player`
+    """
+    player = deepcopy(player) if isinstance(player, Team) else decode_team(player)
+    opponent = deepcopy(opponent) if isinstance(opponent, Team) else decode_team(opponent)
+    if seed is not None:
+        random.seed(seed)
+    if engine is None:
+        engine = subgame_cache if memoize else GameState.do_combat
+    with quiet(), using_rng(rng if rng is not None else data_structures.rng):
+        return engine(GameState(player, opponent))
+
+
+def run_batch(matchups: Sequence[Matchup], memoize: bool = False) -> List[int]:
+    """ Run every (player, opponent, seed) matchup in order. Top level so it can be sent to a process pool """
+    return [run_battle(p, o, seed, memoize=memoize) for p, o, seed in matchups]
+
+
+def run_batch_isolated(matchups: Sequence[Matchup], memoize: bool = False) -> List[Union[int, Exception]]:
+    """
+    Same as run_batch, but a battle that raises gives its exception in place of a result instead of failing the whole
+    batch
+    """
+    results: List[Union[int, Exception]] = []
+    for p, o, seed in matchups:
+        try:
+            results.append(run_battle(p, o, seed, memoize=memoize))
+        except Exception as e:
+            results.append(e)
+    return results
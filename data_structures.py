@@ -21,6 +21,12 @@ is added to the resolution queue it is just skipped and nothing is printed, whil
 showing whether, and in what order, events were resolved. 
 """
 
+rng = random
+"""
+Source of randomness used for every random choice made by the engine. Anything with the same `randint` and `sample`
+methods as the `random` module can be swapped in, e.g. to record or replay the choices made during a battle
+"""
+
 # alias for data class decorator since every subclass of Animal should use it with the same params
 dc = lambda: dataclass(repr=False, eq=False)
 
@@ -111,6 +117,28 @@ class Animal:
         if self.name is None:
             self.name = self.__class__.__name__
 
+    def reset(self, species: Optional[Type[Animal]] = None, attack: Optional[int] = None,
+              health: Optional[int] = None, temp_attack: int = 0, temp_health: int = 0, rank: Optional[int] = None,
+              level: int = 1, name: Optional[str] = None):
+        """
+        Reload this object in place as a new Animal of `species` (by default its current species), for reusing
+        Animals instead of allocating new ones. Stats that aren't given are set to the species' defaults, and it is
+        removed from its team
+        """
+        if species is not None and species is not self.__class__:
+            if not issubclass(species, Animal):
+                raise TypeError(f"{species} is not a subclass of Animal")
+            self.__class__ = species  # every Animal has the same fields, so this is safe
+        cls = self.__class__
+        self.name = cls.__name__ if name is None else name
+        self.attack = cls.attack if attack is None else attack
+        self.health = cls.health if health is None else health
+        self.temp_attack = temp_attack
+        self.temp_health = temp_health
+        self.rank = cls.rank if rank is None else rank
+        self.level = level
+        self.current_team = None
+
     def __str__(self):
         attack_str = f'{self.attack}' if self.temp_attack == 0 else f'({self.attack}+{self.temp_attack})'
         health_str = f'{self.health}' if self.temp_health == 0 else f'({self.health}+{self.temp_health})'
@@ -126,6 +154,7 @@ class Animal:
         # noinspection PyArgumentList
         result = self.__class__(name=self.name, attack=self.attack, health=self.health)
         result.temp_attack, result.temp_health = self.temp_attack, self.temp_health
+        result.rank, result.level = self.rank, self.level
         return result
 
     def __deepcopy__(self, memo=None):
@@ -203,7 +232,9 @@ class Animal:
     def on_faint(self) -> Optional[ActionFunc]:
         """ Called when current_health reaches 0 """
         def remove_corpse(state: GameState):
-            self.current_team[self] = None
+            # the corpse may already have been cleared out by Team.validate() after the damage step
+            if any(self is f for f in self.current_team):
+                self.current_team[self] = None
         return ActionFunc(remove_corpse, description=f'Remove corpse of {self.name}', source=self)
 
     def on_friend_ahead_attack(self) -> Optional[ActionFunc]:
@@ -246,6 +277,7 @@ class Team:
             friends = [None, None, None, None, None]
         if not isinstance(friends, Iterable):
             raise TypeError(f"friends must be Iterable")
+        friends = list(friends)  # validate() works in place, so don't modify the caller's list
         if (filtered := len([f for f in friends if f is not None])) > Team.max_team_size:
             raise ValueError(f"Too many friends to init ({filtered} > {Team.max_team_size})")
         if not all([isinstance(a, Animal) or a is None for a in friends]):
@@ -314,7 +346,8 @@ class Team:
         return f"Team({self.friends})"
 
     def __copy__(self):
-        return Team(copy(self.friends))
+        # Team.__init__ would point the shared Animals' current_team at the copy, so share them through a view instead
+        return TeamView(self)
 
     def __deepcopy__(self, memodict=None):
         return Team(deepcopy(self.friends))
@@ -348,20 +381,108 @@ class Team:
         shifts all friends to front and pad back with None to ensure `len(self.friends) == Team.max_team_size`,
         and removes all friends with current_health <= 0
         """
-        # might be a more efficient way to do this but whatever
-        self.friends = self.get_friends()
-        if len(self.friends) > Team.max_team_size:
+        # this runs after every resolution step, so it compacts self.friends in place instead of building new lists
+        friends = self.friends
+        if len(friends) - friends.count(None) > Team.max_team_size:
             raise ValueError(f"Team {self} has more than {Team.max_team_size} animals")
-        no_corpses = list(filter(lambda x: x.current_health > 0, self.friends))
-        self.friends = no_corpses + ([None] * (Team.max_team_size - len(self.friends)))
+        alive = 0
+        for a in friends:
+            if a is not None and a.current_health > 0:
+                friends[alive] = a
+                alive += 1
+        del friends[Team.max_team_size:]
+        for i in range(alive, len(friends)):
+            friends[i] = None
+        while len(friends) < Team.max_team_size:
+            friends.append(None)
+
+    def reset(self, friends: TeamInitType = ()):
+        """ Reload this Team in place with `friends`, like Team.__init__ but reusing the existing list """
+        self.friends.clear()
+        for f in friends:
+            if not (isinstance(f, Animal) or f is None):
+                raise ValueError(f"Team must only contain Animals or None")
+            if f is not None:
+                f.current_team = self
+            self.friends.append(f)
+        self.validate()
 
     def get_friends(self) -> List[Animal]:
         """ :returns a list over the Animals of this team in order, not including any empty slots (list has no None) """
         return [x for x in self.friends if x is not None]
 
     def get_random_friends(self, n: int) -> List[Animal]:
-        """ :returns `n` randomly selected Animals on this team in a random order"""
-        return random.sample(self.get_friends(), n)
+        """
+        :returns `n` randomly selected Animals on this team in a random order. If there are fewer than `n` Animals
+        on the team then all of them are returned (in a random order)
+        """
+        friends = self.get_friends()
+        return rng.sample(friends, min(n, len(friends)))
+
+
+class TeamView(Team):
+    """
+    Copy-on-write view of another Team, for cheaply building hypothetical boards that differ from `base` in only a
+    few slots. A new view shares every Animal with `base` and only allocates its own list of slots.
+
+    Writing a slot (view[i] = animal) only changes the view. A new Animal joins the view, while one that already
+    belongs to a team (e.g. a shared Animal read from another slot) is copied first. Before an Animal read through the
+    view is modified it must be materialized (see `materialize`, `temp_buff` and `perma_buff`), which replaces it in
+    the view with a private copy whose `current_team` is the view. Animals that have not been materialized still
+    belong to `base`, so `view[i].current_team is view` tells whether slot i is private.
+
+    Putting a view in a GameState materializes all of it, since combat modifies every Animal.
+    """
+
+    def __init__(self, base: Team):
+        # deliberately doesn't call Team.__init__, which would set current_team on Animals that are still shared
+        self.base = base
+        self.friends: List[Optional[Animal]] = list(base.friends)
+
+    def __setitem__(self, key, value):
+        if isinstance(value, Animal) and value.current_team is not self:
+            if value.current_team is not None:  # still shared with `base`, or on another team, so write a copy
+                value = copy(value)
+            value.current_team = self
+        super().__setitem__(key, value)
+
+    def __repr__(self):
+        return f"TeamView({self.friends})"
+
+    def is_materialized(self, key: Union[int, Animal]) -> bool:
+        """ :returns whether the Animal at position `key`, or `key` itself if it is an Animal, is private to this view """
+        animal = self[key] if isinstance(key, int) else key
+        return animal is not None and animal.current_team is self
+
+    def materialize(self, key: Union[int, Animal]) -> Optional[Animal]:
+        """
+        Replace the shared Animal at position `key` (or `key` itself if it is an Animal on this view) with a private
+        copy that can safely be modified. :returns the Animal now in that position, or None if the position is empty
+        """
+        i = key if isinstance(key, int) else self.index_of(key)
+        animal = self[i]
+        if animal is None or animal.current_team is self:
+            return animal
+        animal = copy(animal)
+        animal.current_team = self
+        self.friends[i] = animal
+        return animal
+
+    def materialize_all(self):
+        for i in range(len(self.friends)):
+            self.materialize(i)
+
+    def temp_buff(self, key: Union[int, Animal], a: int, h: int):
+        """ Animal.temp_buff on the Animal at `key`, materializing it first """
+        self.materialize(key).temp_buff(a, h)
+
+    def perma_buff(self, key: Union[int, Animal], a: int, h: int):
+        """ Animal.perma_buff on the Animal at `key`, materializing it first """
+        self.materialize(key).perma_buff(a, h)
+
+    def to_team(self) -> Team:
+        """ :returns an independent Team with copies of every Animal in this view """
+        return deepcopy(self)
 
 
 class GameState:
@@ -380,9 +501,15 @@ class GameState:
         shop: List[Animal]  # TODO: change this type when implementing food
             Animals and foods that are currently available in the shop. Empty list when in combat phase
 
+        gold: int
+            gold the player has left to spend in the shop phase
+
         is_combat_phase: bool
             whether the game is currently in the combat phase. If False then game is in the shop phase
 
+        step_callback: Optional[Callable[[GameState, ActionFunc], None]]
+            if set, called with this GameState and each ActionFunc just before it is resolved
+
         Methods
         -------
         resolve_queue:
@@ -397,9 +524,9 @@ class GameState:
 
     def __init__(self, player_team: TeamInitType, opponent_team: Optional[TeamInitType] = None,
                  is_combat_phase: bool = True,
-                 shop: List[Animal] = None):
+                 shop: List[Animal] = None, gold: int = 0):
 
-        if is_combat_phase and opponent_team is None:
+        if opponent_team is None:
             opponent_team = Team()
         elif not isinstance(opponent_team, Team):
             if isinstance(opponent_team, Iterable):
@@ -413,11 +540,31 @@ class GameState:
             else:
                 raise ValueError("player_team must be Iterable")
 
+        for team in (player_team, opponent_team):
+            if isinstance(team, TeamView):
+                team.materialize_all()
+
         self.player_team = player_team
         self.opponent_team = opponent_team
         self.is_combat_phase = is_combat_phase
         self.shop = shop
+        self.gold = gold
         self.resolution_queue: List[ActionFunc] = []
+        self.step_callback: Optional[Callable[[GameState, ActionFunc], None]] = None
+
+    def reset(self, player_team: TeamInitType = (), opponent_team: TeamInitType = (), is_combat_phase: bool = True,
+              shop: List[Animal] = None, gold: int = 0):
+        """
+        Reload this GameState in place: both Teams are reset with the given Animals (see Team.reset) and the
+        resolution queue is cleared. Used to reuse GameStates in batch runs instead of allocating new ones
+        """
+        self.player_team.reset(player_team)
+        self.opponent_team.reset(opponent_team)
+        self.is_combat_phase = is_combat_phase
+        self.shop = shop
+        self.gold = gold
+        self.resolution_queue.clear()
+        self.step_callback = None
 
     def __str__(self):
         s = "============= COMBAT =============\n" if self.is_combat_phase else "============== SHOP ==============\n"
@@ -457,6 +604,8 @@ class GameState:
             print(self)
         if LOGGING_LEVEL > 0:
             print(f"{f}")
+        if self.step_callback is not None:
+            self.step_callback(self, f)
 
         f(self)
 
@@ -480,6 +629,33 @@ class GameState:
         if LOGGING_LEVEL > 0:
             print(f"Attack finished: {strong}  {weak}")
 
+    def start_combat(self):
+        """ Resolve every Animal's start of combat ability. Raises ValueError if state is not in combat phase """
+        if not self.is_combat_phase:
+            raise ValueError("GameState is not in combat phase")
+
+        for a in reversed(get_teams_priority(self.player_team, self.opponent_team)):
+            self.add_action(a.on_combat_start(), trigger_name='on_combat_start')
+        self.resolve()
+
+    def do_combat(self, max_attacks: int = 1000) -> int:
+        """
+        Resolve a full battle: start of combat abilities, then attacks until at least one team is empty. Raises
+        ValueError if state is not in combat phase
+
+        :returns 1 if player_team won, -1 if opponent_team won, and 0 for a draw
+        """
+        self.start_combat()
+
+        num_attacks = 0
+        while len(self.player_team) > 0 and len(self.opponent_team) > 0:
+            if num_attacks >= max_attacks:
+                raise Exception(f"Combat did not complete after {max_attacks} attacks. Possible infinite loop?")
+            self.do_attack()
+            num_attacks += 1
+
+        return battle_outcome(self.player_team, self.opponent_team)
+
 
 # ################################################# Helper Functions ################################################# # 
 
@@ -531,7 +707,7 @@ def get_priority(a1: Animal, a2: Animal) -> Tuple[Animal, Animal]:
     elif a1.current_attack < a2.current_attack:
         return a2, a1
     else:
-        if random.randint(0, 1):
+        if rng.randint(0, 1):
             return a1, a2
         else:
             return a2, a1
@@ -542,5 +718,14 @@ def get_teams_priority(t1: Team, t2: Optional[Team] = None) -> List[Animal]:
     return sorted(all_animals, key=lambda x: x.attack)
 
 
+def battle_outcome(player_team: Team, opponent_team: Team) -> int:
+    """ :returns 1 if only player_team has Animals left, -1 if only opponent_team does, and 0 otherwise """
+    if len(player_team) > 0 and len(opponent_team) == 0:
+        return 1
+    if len(opponent_team) > 0 and len(player_team) == 0:
+        return -1
+    return 0
+
+
 def do_nothing(source):
     return ActionFunc(lambda x: None, "Do Nothing", source)
@@ -0,0 +1,133 @@
+"""
+Batched encoding of GameStates into a NumPy feature matrix, for feeding learning pipelines.
+
+Each state becomes one row of `StateEncoder.feature_size` values:
+
+    [is_combat_phase, player slot 0..4, opponent slot 0..4, shop slot 0..max_shop-1]
+
+and each slot is a one-hot species followed by attack, health, temp_attack, temp_health, level and rank. Empty slots
+are all zeros. Shop slots are only filled in during the shop phase, and opponent slots only in combat.
+
+Rows are written into a preallocated buffer with a single scatter per batch, and `encode` returns a view of that
+buffer rather than a copy.
+"""
+from __future__ import annotations
+from typing import List, Optional, Sequence
+import time
+
+import numpy as np
+
+from battle import SPECIES
+from data_structures import GameState, Team, Animal
+
+STATS = ('attack', 'health', 'temp_attack', 'temp_health', 'level', 'rank')
+
+
+class StateEncoder:
+    def __init__(self, species: Optional[Sequence[str]] = None, max_shop: int = 7, dtype=np.float32):
+        self.species: List[str] = sorted(SPECIES) if species is None else list(species)
+        self.species_index = {name: i for i, name in enumerate(self.species)}
+        self.max_shop = max_shop
+        self.dtype = dtype
+        self.slot_size = len(self.species) + len(STATS)
+        self.num_slots = 2 * Team.max_team_size + max_shop
+        self.feature_size = 1 + self.num_slots * self.slot_size
+        self._buffer: Optional[np.ndarray] = None
+
+    def slot_offset(self, slot: int) -> int:
+        """ :returns the column where slot `slot` starts. Player slots are 0-4, opponent 5-9, then the shop """
+        return 1 + slot * self.slot_size
+
+    def allocate(self, batch_size: int) -> np.ndarray:
+        """ Allocate (or grow) the buffer that `encode` writes into when no `out` is given """
+        if self._buffer is None or self._buffer.shape[0] < batch_size:
+            self._buffer = np.zeros((batch_size, self.feature_size), dtype=self.dtype)
+        return self._buffer
+
+    def _scatter_slot(self, animal: Animal, row: int, offset: int, rows: list, cols: list, vals: list):
+        rows.extend((row,) * (len(STATS) + 1))
+        cols.append(offset + self.species_index[animal.__class__.__name__])
+        base = offset + len(self.species)
+        cols.extend((base, base + 1, base + 2, base + 3, base + 4, base + 5))
+        vals.extend((1, animal.attack, animal.health, animal.temp_attack, animal.temp_health, animal.level,
+                     animal.rank))
+
+    def encode(self, states: Sequence[GameState], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Write `states` into the first len(states) rows of `out` (or of this encoder's own buffer).
+
+        :returns a view of the rows that were written. If `out` isn't given, the view is only valid until the next
+         call to encode
+        """
+        n = len(states)
+        if out is None:
+            out = self.allocate(n)
+        elif out.shape[0] < n or out.shape[1] != self.feature_size:
+            raise ValueError(f"out must have at least {n} rows and exactly {self.feature_size} columns")
+
+        rows, cols, vals = [], [], []
+        team_size = Team.max_team_size
+        for r, state in enumerate(states):
+            if state.is_combat_phase:
+                rows.append(r)
+                cols.append(0)
+                vals.append(1)
+            for i, a in enumerate(state.player_team.friends):
+                if a is not None:
+                    self._scatter_slot(a, r, self.slot_offset(i), rows, cols, vals)
+            if state.is_combat_phase:
+                for i, a in enumerate(state.opponent_team.friends):
+                    if a is not None:
+                        self._scatter_slot(a, r, self.slot_offset(team_size + i), rows, cols, vals)
+            elif state.shop:
+                if len(state.shop) > self.max_shop:
+                    raise ValueError(f"Shop has more than {self.max_shop} items")
+                for i, a in enumerate(state.shop):
+                    if isinstance(a, Animal):
+                        self._scatter_slot(a, r, self.slot_offset(2 * team_size + i), rows, cols, vals)
+
+        view = out[:n]
+        view.fill(0)
+        view[rows, cols] = vals
+        return view
+
+    def _decode_slot(self, row: np.ndarray, slot: int) -> Optional[Animal]:
+        offset = self.slot_offset(slot)
+        one_hot = row[offset:offset + len(self.species)]
+        if not one_hot.any():
+            return None
+        cls = SPECIES[self.species[int(one_hot.argmax())]]
+        attack, health, temp_attack, temp_health, level, rank = \
+            (int(v) for v in row[offset + len(self.species):offset + self.slot_size])
+        return cls(attack=attack, health=health, temp_attack=temp_attack, temp_health=temp_health, level=level,
+                   rank=rank)
+
+    def decode(self, row: np.ndarray) -> GameState:
+        """ :returns a new GameState built from one encoded row. Mostly useful for debugging """
+        team_size = Team.max_team_size
+        is_combat_phase = bool(row[0])
+        player = [self._decode_slot(row, i) for i in range(team_size)]
+        if is_combat_phase:
+            return GameState(player, [self._decode_slot(row, team_size + i) for i in range(team_size)])
+        shop = [a for a in (self._decode_slot(row, 2 * team_size + i) for i in range(self.max_shop)) if a is not None]
+        return GameState(player, [], is_combat_phase=False, shop=shop)
+
+
+def benchmark(num_states: int = 100000, batch_size: int = 1024) -> float:
+    """ :returns how many states per second StateEncoder.encode manages on full 5 vs 5 combat states """
+    species = list(SPECIES.values())
+    states = [GameState([species[(i + j) % len(species)]() for j in range(Team.max_team_size)],
+                        [species[(i * 3 + j) % len(species)]() for j in range(Team.max_team_size)])
+              for i in range(batch_size)]
+    encoder = StateEncoder()
+    encoder.allocate(batch_size)
+    start = time.perf_counter()
+    done = 0
+    while done < num_states:
+        encoder.encode(states)
+        done += batch_size
+    return done / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    print(f"{benchmark():,.0f} states/s")
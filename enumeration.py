@@ -0,0 +1,192 @@
+"""
+Exact outcome probabilities of a battle, by enumerating every random choice the engine can make.
+
+The engine only makes random choices through data_structures.rng (rng.randint for tied attacks in get_priority and
+rng.sample for abilities like Ant.on_faint), so a battle is a tree: every draw is a node with one branch per possible
+result. A path through the tree is the tuple of branch indices taken at each draw. A ScriptedRNG replays a path prefix
+and takes branch 0 at every draw after it, recording how many branches each draw had, so running a battle with it
+reaches one leaf and tells us which sibling paths are left to explore. Each leaf's probability is the product of
+1 / (number of branches) over its draws, kept as a Fraction so the merged distribution is exact.
+
+enumerate_outcomes splits the tree at its first `split_depth` draws into independent subtrees and explores them
+across a process pool. A task that hits `max_leaves` hands back the paths it didn't get to, and those are resubmitted
+as new, smaller tasks, so idle workers take over the rest of large subtrees instead of waiting on one worker.
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple, Callable
+from concurrent.futures import ProcessPoolExecutor, Executor, FIRST_COMPLETED, wait
+from fractions import Fraction
+from math import perm
+import os
+
+from battle import TeamSpec, as_team_spec, run_battle
+from data_structures import GameState
+
+Path = Tuple[int, ...]
+Engine = Callable[[GameState], int]
+
+
+class ScriptedRNG:
+    """
+    Makes the random choices given by `prefix`, then always takes the first branch.
+
+    Attributes
+    ----------
+    path: List[int]
+        the branch taken at each draw so far
+
+    counts: List[int]
+        the number of branches at each draw so far
+    """
+
+    def __init__(self, prefix: Path = ()):
+        self.prefix = prefix
+        self.path: List[int] = []
+        self.counts: List[int] = []
+
+    def _choose(self, count: int) -> int:
+        i = len(self.path)
+        choice = self.prefix[i] if i < len(self.prefix) else 0
+        if not 0 <= choice < count:
+            raise ValueError(f"Draw {i} has {count} branches, so branch {choice} doesn't exist")
+        self.path.append(choice)
+        self.counts.append(count)
+        return choice
+
+    def randint(self, a: int, b: int) -> int:
+        return a + self._choose(b - a + 1)
+
+    def sample(self, population: Sequence, n: int) -> list:
+        """ Every ordered selection is one branch. Branch c picks index c % len, then c // len among the rest, ... """
+        choice = self._choose(perm(len(population), n))
+        remaining = list(population)
+        chosen = []
+        for _ in range(n):
+            choice, i = divmod(choice, len(remaining))
+            chosen.append(remaining.pop(i))
+        return chosen
+
+    @property
+    def probability(self) -> Fraction:
+        p = Fraction(1)
+        for count in self.counts:
+            p /= count
+        return p
+
+
+def _run_path(player: TeamSpec, opponent: TeamSpec, prefix: Path, engine: Optional[Engine]) \
+        -> Tuple[int, ScriptedRNG]:
+    rng = ScriptedRNG(prefix)
+    return run_battle(player, opponent, rng=rng, engine=engine), rng
+
+
+def explore(player: TeamSpec, opponent: TeamSpec, paths: Sequence[Path] = ((),), max_leaves: Optional[int] = None,
+            engine: Optional[Engine] = None) -> Tuple[Dict[int, Fraction], int, List[Path]]:
+    """
+    Depth first search of the subtrees starting at each of `paths`, stopping after `max_leaves` leaves.
+
+    :returns (probability of each outcome over the leaves that were reached, number of leaves, the paths still left
+     to explore)
+    """
+    probabilities: Dict[int, Fraction] = {}
+    stack = list(paths)
+    leaves = 0
+    while stack and (max_leaves is None or leaves < max_leaves):
+        prefix = stack.pop()
+        outcome, rng = _run_path(player, opponent, prefix, engine)
+        probabilities[outcome] = probabilities.get(outcome, 0) + rng.probability
+        leaves += 1
+        for i in range(len(prefix), len(rng.path)):
+            stack.extend(tuple(rng.path[:i]) + (c,) for c in range(rng.counts[i] - 1, 0, -1))
+    return probabilities, leaves, stack
+
+
+def _explore_job(args) -> Tuple[Dict[int, Fraction], int, List[Path]]:
+    return explore(*args)
+
+
+def _merge(into: Dict[int, Fraction], probabilities: Dict[int, Fraction]):
+    for outcome, p in probabilities.items():
+        into[outcome] = into.get(outcome, 0) + p
+
+
+def split(player: TeamSpec, opponent: TeamSpec, depth: int, engine: Optional[Engine] = None) \
+        -> Tuple[List[Path], Dict[int, Fraction], int]:
+    """
+    Expand the first `depth` draws of the tree.
+
+    :returns (the paths of length `depth`, the probability of each outcome over leaves that are reached with fewer
+     draws, the number of those leaves)
+    """
+    frontier: List[Path] = [()]
+    probabilities: Dict[int, Fraction] = {}
+    leaves = 0
+    for d in range(depth):
+        expanded = []
+        for prefix in frontier:
+            outcome, rng = _run_path(player, opponent, prefix, engine)
+            if len(rng.path) > d:
+                expanded.extend(prefix + (c,) for c in range(rng.counts[d]))
+            else:
+                probabilities[outcome] = probabilities.get(outcome, 0) + rng.probability
+                leaves += 1
+        frontier = expanded
+    return frontier, probabilities, leaves
+
+
+class Enumeration:
+    def __init__(self, probabilities: Dict[int, Fraction], leaves: int, tasks: int):
+        self.probabilities = probabilities
+        """ outcome (WIN, DRAW or LOSS) -> exact probability """
+        self.leaves = leaves
+        self.tasks = tasks
+
+    def __repr__(self):
+        return f"Enumeration({ {k: str(v) for k, v in sorted(self.probabilities.items())} }, " + \
+               f"leaves={self.leaves}, tasks={self.tasks})"
+
+
+def enumerate_outcomes(player, opponent, split_depth: int = 2, max_leaves: int = 2000,
+                       engine: Optional[Engine] = None, executor: Optional[Executor] = None,
+                       max_workers: Optional[int] = None) -> Enumeration:
+    """
+    Exactly enumerate every outcome of a battle between `player` and `opponent` (Teams or TeamSpecs).
+
+    :param split_depth: number of draws to expand in this process before handing subtrees to the pool
+    :param max_leaves: leaves a task explores before handing its unexplored paths back to be resubmitted
+    :param engine: battle engine to run each path with (see run_battle). It must be picklable
+    :returns an Enumeration whose probabilities sum to exactly 1
+    """
+    player, opponent = as_team_spec(player), as_team_spec(opponent)
+    paths, probabilities, leaves = split(player, opponent, split_depth, engine)
+    workers = max_workers or os.cpu_count() or 1
+    owns_executor = executor is None
+    executor = executor if executor is not None else ProcessPoolExecutor(workers)
+    tasks = 0
+    try:
+        pending = set()
+
+        def submit(stack: List[Path]):
+            nonlocal tasks
+            # spread the paths round robin so every task gets a mix of shallow and deep subtrees
+            for i in range(min(workers, len(stack))):
+                pending.add(executor.submit(_explore_job, (player, opponent, stack[i::workers], max_leaves, engine)))
+                tasks += 1
+
+        submit(paths)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task_probabilities, task_leaves, remaining = future.result()
+                _merge(probabilities, task_probabilities)
+                leaves += task_leaves
+                submit(remaining)
+    finally:
+        if owns_executor:
+            executor.shutdown()
+    return Enumeration(probabilities, leaves, tasks)
+
+
+if __name__ == '__main__':
+    from animals import Ant, Fish, Sloth
+    print(enumerate_outcomes([Ant(), Ant(), Ant(), Fish(), Sloth()], [Sloth(), Ant(), Ant(), Fish(), Ant()]))
@@ -0,0 +1,343 @@
+"""
+Pools of opponent teams ("ghosts") for evaluating a board against realistic opposition.
+
+Every team is stored as a fixed width record along with the turn it was seen on, and indexed into buckets by
+(turn, total stats // strength_bucket). Inside a bucket, records are grouped by signature: the team's highest tier and
+its set of species. Species and tier filters are checked once per group rather than once per record, so sampling costs
+O(k log G + G) for the G groups in the nearby buckets, no matter how many teams each group holds.
+
+OpponentPool keeps everything in memory and can be added to. OpponentPool.save writes the records sorted by bucket and
+group so that MappedOpponentPool can memory-map the file and sample from it without loading it.
+"""
+from __future__ import annotations
+from typing import Dict, List, Tuple, Optional, Iterable, Callable, Sequence, Union
+from array import array
+from copy import deepcopy
+from itertools import accumulate
+import json
+import mmap
+import random
+import struct
+
+from battle import SPECIES, TeamSpec, as_team_spec, decode_team
+from data_structures import GameState, Team
+
+_MAGIC = b'SAPPOOL2'
+_HEADER = struct.Struct('<8sI')  # magic, length of the JSON metadata that follows
+_BUCKET = struct.Struct('<HiII')  # turn, strength bucket, first group, one past the last group
+_GROUP = struct.Struct('<BQII')  # highest tier, species mask, first record, one past the last record
+_RECORD_HEAD = struct.Struct('<HhQ6BB')  # turn, total stats, species mask, count per tier 1-6, number of animals
+_SLOT = struct.Struct('<BBBhhhh')  # species id (0 = empty), rank, level, attack, health, temp_attack, temp_health
+RECORD_SIZE: int = _RECORD_HEAD.size + _SLOT.size * Team.max_team_size
+
+BucketKey = Tuple[int, int]
+""" (turn, strength bucket) """
+
+Signature = Tuple[int, int]
+""" (highest tier on the team, species mask) """
+
+
+class PoolEntry:
+    """ A sampled opponent: the team, the turn it was recorded on, and its index metadata """
+    __slots__ = ('team', 'turn', 'total_stats', 'tiers', 'species')
+
+    def __init__(self, team: TeamSpec, turn: int, total_stats: int, tiers: Tuple[int, ...], species: frozenset):
+        self.team = team
+        self.turn = turn
+        self.total_stats = total_stats
+        self.tiers = tiers
+        self.species = species
+
+    def __repr__(self):
+        return f"PoolEntry({self.team}, turn={self.turn}, total_stats={self.total_stats})"
+
+
+class _Pool:
+    """ Sampling logic shared by the in-memory and memory-mapped pools """
+
+    def __init__(self, species_names: Sequence[str], strength_bucket: int):
+        if strength_bucket < 1:
+            raise ValueError("strength_bucket must be at least 1")
+        self.species_names: List[str] = list(species_names)
+        self.species_ids: Dict[str, int] = {name: i + 1 for i, name in enumerate(self.species_names)}
+        self.strength_bucket = strength_bucket
+        # per turn, the sorted strength buckets present so nearby buckets can be found without scanning every key
+        self._turn_buckets: Dict[int, List[int]] = {}
+
+    # implemented by subclasses
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def _bucket(self, key: BucketKey) -> Sequence[int]:
+        """ :returns the record ids in a bucket """
+        raise NotImplementedError
+
+    def _groups(self, key: BucketKey) -> Iterable[Tuple[Signature, Sequence[int]]]:
+        """ :returns (signature, record ids) for each group in a bucket """
+        raise NotImplementedError
+
+    def _record(self, record_id: int) -> Union[bytes, memoryview]:
+        raise NotImplementedError
+
+    def _index_key(self, key: BucketKey):
+        turn, bucket = key
+        buckets = self._turn_buckets.setdefault(turn, [])
+        if bucket not in buckets:
+            buckets.append(bucket)
+            buckets.sort()
+
+    def strength(self, team: Union[Team, TeamSpec, Iterable]) -> int:
+        """ :returns the total stats of a team, which is what the pool uses as its strength measure """
+        return sum(a[1] + a[2] + a[3] + a[4] for a in as_team_spec(team))
+
+    def _mask(self, species: Iterable[str]) -> int:
+        mask = 0
+        for name in species:
+            if name not in self.species_ids:
+                raise ValueError(f"Unknown species {name}")
+            mask |= 1 << self.species_ids[name]
+        return mask
+
+    def _bucket_distance(self, bucket: int, strength: int) -> int:
+        """ :returns how far `strength` is from the range of total stats covered by `bucket` """
+        low, high = bucket * self.strength_bucket, (bucket + 1) * self.strength_bucket - 1
+        return max(low - strength, strength - high, 0)
+
+    def _nearby_buckets(self, turn: int, strength: Optional[int], turn_window: int,
+                        strength_window: Optional[int]) -> List[BucketKey]:
+        keys = []
+        for t in range(turn - turn_window, turn + turn_window + 1):
+            for b in self._turn_buckets.get(t, ()):
+                if strength is None or strength_window is None or \
+                        self._bucket_distance(b, strength) <= strength_window:
+                    keys.append((t, b))
+        return keys
+
+    def nearest_turn(self, turn: int) -> int:
+        """
+        :returns the turn in the pool closest to `turn` that has teams (the earlier one on a tie)
+        :raises LookupError if the pool is empty
+        """
+        turns = [t for t, buckets in self._turn_buckets.items() if any(len(self._bucket((t, b))) for b in buckets)]
+        if not turns:
+            raise LookupError("The pool is empty")
+        return min(turns, key=lambda t: (abs(t - turn), t))
+
+    def _decode(self, record_id: int) -> PoolEntry:
+        record = self._record(record_id)
+        turn, total, species_mask, *rest = _RECORD_HEAD.unpack_from(record, 0)
+        tiers, n = tuple(rest[:6]), rest[6]
+        team = []
+        for i in range(n):
+            sid, rank, level, attack, health, temp_attack, temp_health = \
+                _SLOT.unpack_from(record, _RECORD_HEAD.size + i * _SLOT.size)
+            team.append((self.species_names[sid - 1], attack, health, temp_attack, temp_health, rank, level))
+        species = frozenset(self.species_names[i - 1] for i in range(1, len(self.species_names) + 1)
+                            if species_mask >> i & 1)
+        return PoolEntry(tuple(team), turn, total, tiers, species)
+
+    @staticmethod
+    def _matches(signature: Signature, require_mask: int, exclude_mask: int, max_tier: Optional[int]) -> bool:
+        tier, species_mask = signature
+        return species_mask & require_mask == require_mask and not species_mask & exclude_mask and \
+            (max_tier is None or tier <= max_tier)
+
+    def sample(self, k: int, turn: int, strength: Optional[int] = None, turn_window: int = 0,
+               strength_window: Optional[int] = None, stratified: bool = False,
+               bucket_weight: Optional[Callable[[int, int], float]] = None,
+               require_species: Iterable[str] = (), exclude_species: Iterable[str] = (),
+               max_tier: Optional[int] = None, rng: random.Random = None) -> List[PoolEntry]:
+        """
+        Sample `k` opponents (with replacement) from turns within `turn_window` of `turn` and, if given, with total
+        stats within `strength_window` of `strength`. Strength is matched at the granularity of the pool's buckets, so
+        teams up to `strength_bucket - 1` further away may also be returned.
+
+        Species and tier filters are applied first, and the rest applies to the teams that pass them.
+
+        :param stratified: if True every matching bucket is equally likely to be drawn from, otherwise every matching
+         team is equally likely
+        :param bucket_weight: optional extra weight for each bucket, given (turn distance, strength distance)
+        :param require_species: only return teams containing all of these species
+        :param exclude_species: only return teams containing none of these species
+        :param max_tier: only return teams with no animals above this tier
+        :raises LookupError if there are no matching teams
+        """
+        rng = rng if rng is not None else random
+        keys = [key for key in self._nearby_buckets(turn, strength, turn_window, strength_window)
+                if len(self._bucket(key)) > 0]
+        if not keys:
+            raise LookupError(f"No teams in pool near turn {turn} and strength {strength}")
+
+        require_mask, exclude_mask = self._mask(require_species), self._mask(exclude_species)
+        filtered = require_mask or exclude_mask or max_tier is not None
+        # each candidate is a sequence of record ids, drawn from with a weight and then uniformly inside
+        candidates, weights = [], []
+        for t, b in keys:
+            w = 1. if bucket_weight is None else \
+                bucket_weight(abs(t - turn), 0 if strength is None else self._bucket_distance(b, strength))
+            groups = [ids for signature, ids in self._groups((t, b))
+                      if self._matches(signature, require_mask, exclude_mask, max_tier)] if filtered \
+                else [self._bucket((t, b))]
+            matching = sum(len(ids) for ids in groups)
+            for ids in groups:
+                candidates.append(ids)
+                weights.append(w * len(ids) / matching if stratified else w * len(ids))
+        if not candidates:
+            raise LookupError("No teams in pool match the given filters")
+
+        cum_weights = list(accumulate(weights))
+        if cum_weights[-1] <= 0:
+            raise LookupError("Every matching bucket has zero weight")
+        return [self._decode(ids[rng.randrange(len(ids))])
+                for ids in rng.choices(candidates, cum_weights=cum_weights, k=k)]
+
+    def sample_teams(self, k: int, turn: int, **kwargs) -> List[Team]:
+        """ Same as `sample`, but returns new Teams """
+        return [decode_team(e.team) for e in self.sample(k, turn, **kwargs)]
+
+    def sample_states(self, player_team: Union[Team, Iterable], k: int, turn: int, **kwargs) -> List[GameState]:
+        """
+        :returns `k` combat GameStates, each with its own copy of `player_team` against a sampled opponent near
+        `turn`. If `strength` is not given, the strength of `player_team` is used
+        """
+        player_team = player_team if isinstance(player_team, Team) else Team(list(player_team))
+        kwargs.setdefault('strength', self.strength(player_team))
+        return [GameState(deepcopy(player_team), opponent) for opponent in self.sample_teams(k, turn, **kwargs)]
+
+
+class OpponentPool(_Pool):
+    """ Growable pool kept entirely in memory """
+
+    def __init__(self, strength_bucket: int = 5, species_names: Optional[Sequence[str]] = None):
+        super().__init__(sorted(SPECIES) if species_names is None else species_names, strength_bucket)
+        if len(self.species_names) > 63:
+            raise ValueError("Pools support at most 63 species")
+        self._records = bytearray()
+        self._buckets: Dict[BucketKey, array] = {}
+        self._signatures: Dict[BucketKey, Dict[Signature, array]] = {}
+
+    def __len__(self):
+        return len(self._records) // RECORD_SIZE
+
+    def _bucket(self, key):
+        return self._buckets.get(key, ())
+
+    def _groups(self, key):
+        return self._signatures.get(key, {}).items()
+
+    def _record(self, record_id):
+        return memoryview(self._records)[record_id * RECORD_SIZE:(record_id + 1) * RECORD_SIZE]
+
+    def add(self, team: Union[Team, TeamSpec, Iterable], turn: int) -> int:
+        """ Add a team seen on `turn` to the pool. :returns the id of the new record """
+        spec = as_team_spec(team)
+        if len(spec) > Team.max_team_size:
+            raise ValueError(f"Too many animals ({len(spec)} > {Team.max_team_size})")
+        tiers = [0] * 6
+        total = 0
+        for a in spec:
+            total += a[1] + a[2] + a[3] + a[4]
+            tiers[min(max(a[5], 1), 6) - 1] += 1
+        record = bytearray(RECORD_SIZE)
+        _RECORD_HEAD.pack_into(record, 0, turn, total, self._mask(a[0] for a in spec), *tiers, len(spec))
+        for i, a in enumerate(spec):
+            _SLOT.pack_into(record, _RECORD_HEAD.size + i * _SLOT.size, self.species_ids[a[0]], a[5], a[6],
+                            a[1], a[2], a[3], a[4])
+        record_id = len(self)
+        self._records += record
+        key = (turn, total // self.strength_bucket)
+        if key not in self._buckets:
+            self._buckets[key] = array('I')
+            self._signatures[key] = {}
+            self._index_key(key)
+        self._buckets[key].append(record_id)
+        signature = (max((i + 1 for i, n in enumerate(tiers) if n), default=0), self._mask(a[0] for a in spec))
+        self._signatures[key].setdefault(signature, array('I')).append(record_id)
+        return record_id
+
+    def extend(self, teams: Iterable[Tuple[Union[Team, TeamSpec, Iterable], int]]):
+        """ Add every (team, turn) pair """
+        for team, turn in teams:
+            self.add(team, turn)
+
+    def save(self, path: str):
+        """ Write this pool to `path` sorted by bucket and group, in the format read by MappedOpponentPool """
+        keys = sorted(self._buckets)
+        groups = [(signature, self._signatures[key][signature]) for key in keys
+                  for signature in sorted(self._signatures[key])]
+        meta = json.dumps({'species': self.species_names, 'strength_bucket': self.strength_bucket,
+                           'record_size': RECORD_SIZE, 'num_records': len(self), 'num_buckets': len(keys),
+                           'num_groups': len(groups)}).encode()
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(meta)))
+            f.write(meta)
+            start = 0
+            for key in keys:
+                end = start + len(self._signatures[key])
+                f.write(_BUCKET.pack(key[0], key[1], start, end))
+                start = end
+            start = 0
+            for (tier, species_mask), ids in groups:
+                f.write(_GROUP.pack(tier, species_mask, start, start + len(ids)))
+                start += len(ids)
+            records = memoryview(self._records)
+            for _, ids in groups:
+                for record_id in ids:
+                    f.write(records[record_id * RECORD_SIZE:(record_id + 1) * RECORD_SIZE])
+
+
+class MappedOpponentPool(_Pool):
+    """ Read-only pool backed by a memory-mapped file written by OpponentPool.save """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, meta_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not an opponent pool file")
+        meta = json.loads(self._mm[_HEADER.size:_HEADER.size + meta_len])
+        if meta['record_size'] != RECORD_SIZE:
+            raise ValueError(f"{path} has records of size {meta['record_size']}, expected {RECORD_SIZE}")
+        super().__init__(meta['species'], meta['strength_bucket'])
+        self._num_records = meta['num_records']
+        offset = _HEADER.size + meta_len
+        group_ranges: Dict[BucketKey, Tuple[int, int]] = {}
+        for _ in range(meta['num_buckets']):
+            turn, bucket, start, end = _BUCKET.unpack_from(self._mm, offset)
+            group_ranges[(turn, bucket)] = (start, end)
+            self._index_key((turn, bucket))
+            offset += _BUCKET.size
+        groups = []
+        for _ in range(meta['num_groups']):
+            tier, species_mask, start, end = _GROUP.unpack_from(self._mm, offset)
+            groups.append(((tier, species_mask), range(start, end)))
+            offset += _GROUP.size
+        # a bucket's groups are stored next to each other, so its records are one contiguous range too
+        self._signatures: Dict[BucketKey, List[Tuple[Signature, range]]] = \
+            {key: groups[start:end] for key, (start, end) in group_ranges.items()}
+        self._buckets: Dict[BucketKey, range] = \
+            {key: range(g[0][1].start, g[-1][1].stop) for key, g in self._signatures.items() if g}
+        self._records_offset = offset
+
+    def __len__(self):
+        return self._num_records
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _bucket(self, key):
+        return self._buckets.get(key, ())
+
+    def _groups(self, key):
+        return self._signatures.get(key, ())
+
+    def _record(self, record_id):
+        offset = self._records_offset + record_id * RECORD_SIZE
+        return self._mm[offset:offset + RECORD_SIZE]
@@ -0,0 +1,264 @@
+"""
+Evolutionary search over team compositions.
+
+A candidate board is a TeamSpec whose species come from animals.py and whose stats, levels and order are free, within
+a total stat budget. Fitness is the score (wins + draws / 2) over a fixed set of battles against an opponent pool.
+
+Fitness evaluations are spread across a process pool. Results are cached per board, so boards that survive or
+reappear in later generations are never re-simulated, and a candidate stops being evaluated as soon as even winning
+every remaining battle couldn't lift it to the fitness of the weakest elite. Such candidates are cached as partial
+results and resumed if they are ever needed again with a lower bar.
+"""
+from __future__ import annotations
+from typing import List, Optional, Sequence, Dict, Tuple, Iterable, Union
+from concurrent.futures import ProcessPoolExecutor, Executor
+import os
+import random
+import time
+
+from battle import SPECIES, WIN, DRAW, TeamSpec, AnimalSpec, as_team_spec, run_battle
+from data_structures import Team
+
+MAX_LEVEL: int = 3
+
+
+def total_stats(genome: TeamSpec) -> int:
+    return sum(a[1] + a[2] for a in genome)
+
+
+def _evaluate(genome: TeamSpec, battles: Sequence[Tuple[TeamSpec, int]], start: int, score: float,
+              threshold: float) -> Tuple[float, int]:
+    """
+    Run `battles[start:]`, starting from `score`, stopping once the final fitness can no longer reach `threshold`.
+
+    :returns the new (score, number of battles played)
+    """
+    total = len(battles)
+    for i in range(start, total):
+        opponent, seed = battles[i]
+        outcome = run_battle(genome, opponent, rng=random.Random(seed))
+        score += 1. if outcome == WIN else .5 if outcome == DRAW else 0.
+        if (score + total - i - 1) / total < threshold:
+            return score, i + 1
+    return score, total
+
+
+def _evaluate_job(args) -> Tuple[float, int]:
+    return _evaluate(*args)
+
+
+class GenerationStats:
+    """ `mean_fitness` is the mean over the boards in the generation that were fully evaluated """
+
+    def __init__(self, generation: int, best: TeamSpec, best_fitness: float, mean_fitness: float, battles: int,
+                 cache_hits: int, dropped: int, seconds: float):
+        self.generation = generation
+        self.best = best
+        self.best_fitness = best_fitness
+        self.mean_fitness = mean_fitness
+        self.battles = battles
+        self.cache_hits = cache_hits
+        self.dropped = dropped
+        self.seconds = seconds
+
+    def __repr__(self):
+        return f"GenerationStats(gen={self.generation}, best={self.best_fitness:.3f}, " + \
+               f"mean={self.mean_fitness:.3f}, battles={self.battles}, cache_hits={self.cache_hits}, " + \
+               f"dropped={self.dropped}, {self.seconds:.2f}s)"
+
+
+class EvolutionaryOptimizer:
+    """
+    Methods
+    -------
+    step:
+        evaluate the current population, keep the elites and breed the next generation. :returns GenerationStats
+
+    evolve:
+        run `step` a number of times
+
+    fitness:
+        the cached fitness of a board, or None if it hasn't been fully evaluated
+    """
+
+    def __init__(self, opponents: Iterable[Union[Team, TeamSpec, Iterable]], population_size: int = 32,
+                 elite: int = 4, battles_per_opponent: int = 4, team_size: int = Team.max_team_size,
+                 stat_budget: Optional[int] = None, species: Optional[Sequence[str]] = None,
+                 mutation_rate: float = 0.3, seed: int = 0, executor: Optional[Executor] = None,
+                 max_workers: Optional[int] = None):
+        self.opponents: List[TeamSpec] = [as_team_spec(o) for o in opponents]
+        if not self.opponents:
+            raise ValueError("At least one opponent is needed")
+        if not 0 < elite < population_size:
+            raise ValueError("elite must be between 0 and population_size")
+        self.population_size = population_size
+        self.elite = elite
+        self.team_size = team_size
+        self.stat_budget = stat_budget if stat_budget is not None else team_size * 6
+        self.species = sorted(SPECIES) if species is None else list(species)
+        self.mutation_rate = mutation_rate
+        self.rng = random.Random(seed)
+        self.battles: List[Tuple[TeamSpec, int]] = [(o, seed * 1000003 + i * len(self.opponents) + j)
+                                                    for j, o in enumerate(self.opponents)
+                                                    for i in range(battles_per_opponent)]
+        self._owns_executor = executor is None
+        self._executor = executor if executor is not None else ProcessPoolExecutor(max_workers or os.cpu_count())
+        self._cache: Dict[TeamSpec, Tuple[float, int]] = {}
+        """ board -> (score so far, number of battles played) """
+        self.population: List[TeamSpec] = [self.random_genome() for _ in range(population_size)]
+        self.history: List[GenerationStats] = []
+
+    def close(self):
+        if self._owns_executor:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ############################################## Genetic operators ############################################### #
+
+    def _animal(self, species: str, attack: int, health: int, level: int = 1) -> AnimalSpec:
+        return species, max(attack, 1), max(health, 1), 0, 0, SPECIES[species].rank, min(max(level, 1), MAX_LEVEL)
+
+    def _fit_budget(self, genome: List[AnimalSpec]) -> TeamSpec:
+        """ Remove random stat points until `genome` is within the stat budget. Every Animal keeps at least 1/1 """
+        genome = [list(a) for a in genome]
+        excess = sum(a[1] + a[2] for a in genome) - self.stat_budget
+        while excess > 0:
+            candidates = [(i, s) for i, a in enumerate(genome) for s in (1, 2) if a[s] > 1]
+            if not candidates:
+                break
+            i, s = self.rng.choice(candidates)
+            genome[i][s] -= 1
+            excess -= 1
+        return tuple(tuple(a) for a in genome)
+
+    def random_genome(self) -> TeamSpec:
+        n = self.rng.randint(1, self.team_size)
+        genome = []
+        for _ in range(n):
+            cls = SPECIES[self.rng.choice(self.species)]
+            genome.append(self._animal(cls.__name__, cls.attack + self.rng.randint(0, 3),
+                                       cls.health + self.rng.randint(0, 3), self.rng.randint(1, MAX_LEVEL)))
+        return self._fit_budget(genome)
+
+    def mutate(self, genome: TeamSpec) -> TeamSpec:
+        genome = list(genome)
+        r = self.rng.random()
+        i = self.rng.randrange(len(genome))
+        species, attack, health, _, _, _, level = genome[i]
+        if r < 0.2:  # swap in a different species
+            genome[i] = self._animal(self.rng.choice(self.species), attack, health, level)
+        elif r < 0.4 and len(genome) > 1:  # reorder
+            j = self.rng.randrange(len(genome))
+            genome[i], genome[j] = genome[j], genome[i]
+        elif r < 0.6:  # move a stat point between attack and health, or to another Animal
+            target = self.rng.randrange(len(genome))
+            from_attack = self.rng.random() < 0.5
+            if (attack if from_attack else health) > 1:
+                genome[i] = self._animal(species, attack - from_attack, health - (not from_attack), level)
+                t = genome[target]
+                to_attack = self.rng.random() < 0.5
+                genome[target] = self._animal(t[0], t[1] + to_attack, t[2] + (not to_attack), t[6])
+        elif r < 0.7:
+            genome[i] = self._animal(species, attack, health, level + self.rng.choice((-1, 1)))
+        elif r < 0.85 and len(genome) < self.team_size:
+            cls = SPECIES[self.rng.choice(self.species)]
+            genome.insert(self.rng.randint(0, len(genome)), self._animal(cls.__name__, cls.attack, cls.health))
+        elif len(genome) > 1:
+            genome.pop(i)
+        else:  # grow a stat
+            genome[i] = self._animal(species, attack + 1, health, level)
+        return self._fit_budget(genome)
+
+    def crossover(self, a: TeamSpec, b: TeamSpec) -> TeamSpec:
+        """ Front of `a` followed by the back of `b` """
+        child = list(a[:self.rng.randint(1, len(a))]) + list(b[self.rng.randint(0, len(b)):])
+        return self._fit_budget(child[:self.team_size])
+
+    # ################################################## Evaluation ################################################## #
+
+    def fitness(self, genome: TeamSpec) -> Optional[float]:
+        """ :returns the fitness of `genome` if it has been fully evaluated, otherwise None """
+        score, played = self._cache.get(genome, (0., 0))
+        return score / len(self.battles) if played == len(self.battles) else None
+
+    def _evaluate_population(self, threshold: float) -> Tuple[int, int, int]:
+        """ Bring every board in the population up to date. :returns (battles run, cache hits, dropped boards) """
+        jobs, genomes = [], []
+        hits = 0
+        for genome in dict.fromkeys(self.population):  # dedupe, keeping order
+            score, played = self._cache.get(genome, (0., 0))
+            total = len(self.battles)
+            if played == total or (score + total - played) / total < threshold:
+                hits += 1
+                continue
+            genomes.append(genome)
+            jobs.append((genome, self.battles, played, score, threshold))
+
+        battles = dropped = 0
+        for genome, job, (score, played) in zip(genomes, jobs,
+                                                self._executor.map(_evaluate_job, jobs,
+                                                                   chunksize=max(1, len(jobs) // 16))):
+            battles += played - job[2]
+            dropped += played < len(self.battles)
+            self._cache[genome] = (score, played)
+        return battles, hits, dropped
+
+    def _upper_bound(self, genome: TeamSpec) -> float:
+        score, played = self._cache.get(genome, (0., 0))
+        return (score + len(self.battles) - played) / len(self.battles)
+
+    def step(self) -> GenerationStats:
+        start = time.perf_counter()
+        # the bar a new board has to be able to reach: the weakest fully evaluated elite from last generation
+        known = sorted((f for g in dict.fromkeys(self.population) if (f := self.fitness(g)) is not None), reverse=True)
+        threshold = known[self.elite - 1] if len(known) >= self.elite else 0.
+        battles, hits, dropped = self._evaluate_population(threshold)
+
+        # boards that were dropped early are ranked by their upper bound, which is below every complete elite
+        ranked = sorted(dict.fromkeys(self.population), key=self._upper_bound, reverse=True)
+        elites = ranked[:self.elite]
+        # boards that were dropped early only have an upper bound, so they're left out of the mean
+        scores = [f for g in self.population if (f := self.fitness(g)) is not None]
+        stats = GenerationStats(len(self.history), elites[0], self._upper_bound(elites[0]), sum(scores) / len(scores),
+                                battles, hits, dropped, time.perf_counter() - start)
+
+        parents = ranked[:max(self.elite, len(ranked) // 2)]
+        children = list(elites)
+        while len(children) < self.population_size:
+            a, b = self.rng.choice(parents), self.rng.choice(parents)
+            child = self.crossover(a, b) if self.rng.random() < 0.5 else a
+            if child == a or self.rng.random() < self.mutation_rate:
+                child = self.mutate(child)
+            children.append(child)
+        self.population = children
+        self.history.append(stats)
+        return stats
+
+    def evolve(self, generations: int) -> List[GenerationStats]:
+        return [self.step() for _ in range(generations)]
+
+    @property
+    def best(self) -> Tuple[TeamSpec, float]:
+        """ :returns the best fully evaluated board seen so far and its fitness """
+        complete = [(g, f) for g in self._cache if (f := self.fitness(g)) is not None]
+        return max(complete, key=lambda x: x[1])
+
+    @property
+    def generations_per_minute(self) -> float:
+        seconds = sum(s.seconds for s in self.history)
+        return 60 * len(self.history) / seconds if seconds > 0 else 0.
+
+
+if __name__ == '__main__':
+    from animals import Ant, Fish, Pig, Sloth
+    pool = [[Fish(), Ant(), Sloth()], [Pig(), Pig(), Ant()], [Ant(), Ant(), Ant(), Fish()], [Fish(), Fish(), Pig()]]
+    with EvolutionaryOptimizer(pool, stat_budget=20) as opt:
+        for gen in opt.evolve(10):
+            print(gen)
+        print(f"best: {opt.best}")
+        print(f"{opt.generations_per_minute:.1f} generations/minute")
@@ -0,0 +1,129 @@
+"""
+Reusable GameState, Team and Animal objects for batch runs.
+
+run_battle builds a new GameState, two Teams and an Animal per slot for every battle and throws them away afterwards.
+A BattlePool allocates one GameState with its two Teams and 2 * Team.max_team_size Animals once, and reloads them in
+place (Animal.reset, Team.reset, GameState.reset) for every battle instead.
+
+Running this module prints an allocation benchmark comparing the two.
+"""
+from __future__ import annotations
+from typing import Optional, Sequence, List, Callable, Dict
+from contextlib import contextmanager
+import random
+import time
+import tracemalloc
+
+import data_structures
+from battle import SPECIES, Matchup, TeamSpec, as_team_spec, quiet, using_rng, run_battle
+from data_structures import GameState, Team, Animal
+
+
+class BattlePool:
+    def __init__(self):
+        self.state = GameState(Team(), Team())
+        self.animals: List[List[Animal]] = [[Animal() for _ in range(Team.max_team_size)] for _ in range(2)]
+        self._loaded: List[List[Animal]] = [[], []]
+
+    def _load_team(self, side: int, spec: TeamSpec) -> List[Animal]:
+        if len(spec) > Team.max_team_size:
+            raise ValueError(f"Too many animals ({len(spec)} > {Team.max_team_size})")
+        loaded = self._loaded[side]
+        loaded.clear()
+        for animal, (species, attack, health, temp_attack, temp_health, rank, level) in zip(self.animals[side], spec):
+            if species not in SPECIES:
+                raise ValueError(f"Unknown species {species}")
+            animal.reset(SPECIES[species], attack, health, temp_attack, temp_health, rank, level)
+            loaded.append(animal)
+        return loaded
+
+    def load(self, player, opponent) -> GameState:
+        """
+        Reload the pooled GameState with a combat between `player` and `opponent` (Teams, lists of Animals or
+        TeamSpecs, which are copied rather than used directly). :returns the pooled GameState, which is only valid
+        until the next call to load
+        """
+        player, opponent = as_team_spec(player), as_team_spec(opponent)
+        self.state.reset(self._load_team(0, player), self._load_team(1, opponent))
+        return self.state
+
+    def run(self, player, opponent, rng=None, engine: Optional[Callable[[GameState], int]] = None) -> int:
+        """ Same as battle.run_battle, using the pooled objects """
+        state = self.load(player, opponent)
+        with quiet(), using_rng(rng if rng is not None else data_structures.rng):
+            return engine(state) if engine is not None else state.do_combat()
+
+    def run_batch(self, matchups: Sequence[Matchup]) -> List[int]:
+        """ Same as battle.run_batch, using the pooled objects """
+        results = []
+        for player, opponent, seed in matchups:
+            if seed is not None:
+                random.seed(seed)
+            results.append(self.run(player, opponent))
+        return results
+
+
+_pool: Optional[BattlePool] = None
+
+
+def run_batch_pooled(matchups: Sequence[Matchup]) -> List[int]:
+    """ battle.run_batch using a BattlePool that is kept for the life of the process, e.g. in a worker pool """
+    global _pool
+    if _pool is None:
+        _pool = BattlePool()
+    return _pool.run_batch(matchups)
+
+
+@contextmanager
+def _count_constructions(counts: Dict[str, int]):
+    """ Count new Animals, Teams and GameStates for the benchmark, by wrapping their constructors """
+    originals = (Animal.__post_init__, Team.__init__, GameState.__init__)
+
+    def counted(name, f):
+        def wrapper(*args, **kwargs):
+            counts[name] = counts.get(name, 0) + 1
+            return f(*args, **kwargs)
+        return wrapper
+
+    Animal.__post_init__ = counted('Animal', originals[0])
+    Team.__init__ = counted('Team', originals[1])
+    GameState.__init__ = counted('GameState', originals[2])
+    try:
+        yield counts
+    finally:
+        Animal.__post_init__, Team.__init__, GameState.__init__ = originals
+
+
+def benchmark(num_battles: int = 2000) -> Dict[str, Dict[str, float]]:
+    """
+    Run the same seeded 5 vs 5 battles with run_battle and with a BattlePool. :returns, for each, the tracemalloc
+    peak, the Animals/Teams/GameStates constructed per battle and battles per second
+    """
+    species = sorted(SPECIES)
+    matchups = [(tuple((species[(i + j) % len(species)], 2 + j, 3 + (i % 4), 0, 0, 1, 1) for j in range(5)),
+                 tuple((species[(i * 3 + j) % len(species)], 3, 2 + j, 0, 0, 1, 1) for j in range(5)), i)
+                for i in range(num_battles)]
+    pool = BattlePool()
+    runners = {'run_battle': lambda m: [run_battle(p, o, seed) for p, o, seed in m],
+               'BattlePool': pool.run_batch}
+    results = {}
+    for name, runner in runners.items():
+        runner(matchups[:10])  # warm up caches so they don't count as allocations
+        counts: Dict[str, int] = {}
+        tracemalloc.start()
+        start = time.perf_counter()
+        with _count_constructions(counts):
+            runner(matchups)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {'peak_bytes': peak, 'battles_per_second': num_battles / seconds,
+                         **{f'{k}_per_battle': v / num_battles for k, v in counts.items()}}
+    return results
+
+
+if __name__ == '__main__':
+    for name, result in benchmark().items():
+        print(name)
+        for k, v in result.items():
+            print(f"\t{k}: {v:,.2f}")
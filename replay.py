@@ -0,0 +1,250 @@
+"""
+Deterministic replay logs, and differential testing of battle engines against each other.
+
+A ReplayLog holds the starting teams and seed of a battle followed by a list of events, in the order they happened:
+
+    ('A', trigger_name, side, slot, description, board)   an ActionFunc about to be resolved
+    ('R', 'randint', a, b, result)                          a call to rng.randint(a, b)
+    ('R', 'sample', population size, n, chosen indices)     a call to rng.sample(population, n)
+    ('O', outcome, board)                                   the end of the battle
+
+`side` is 0 for the player team, 1 for the opponent team and -1 if the action has no source. `slot` is the position
+of the source in its team when the action is resolved, or -1 if it is no longer on the team. `board` is a short
+string describing both teams at that moment.
+
+An engine is any callable that takes a combat GameState and resolves the battle on it, returning WIN, DRAW or LOSS.
+GameState.do_combat is the reference engine. Faster engines should produce the same log for the same seed, and
+diff_engines reports the first event where they don't.
+"""
+from __future__ import annotations
+from typing import List, Optional, Callable, Sequence, Tuple, Union, Iterable
+from contextlib import contextmanager
+import json
+import random
+import zlib
+
+from battle import TeamSpec, Matchup, as_team_spec, decode_team, quiet, using_rng
+from data_structures import GameState, ActionFunc, Team
+
+Engine = Callable[[GameState], int]
+
+
+def reference_engine(state: GameState) -> int:
+    return state.do_combat()
+
+
+def board_string(state: GameState) -> str:
+    """ :returns a compact description of the stats of both teams, e.g. 'Fish2/3,Ant2/1|Sloth1/1' """
+    return '|'.join(','.join(f"{a.__class__.__name__}{a.current_attack}/{a.current_health}"
+                             for a in team.get_friends())
+                    for team in (state.player_team, state.opponent_team))
+
+
+class ReplayLog:
+    def __init__(self, player: TeamSpec, opponent: TeamSpec, seed: Optional[int] = None,
+                 events: Optional[List[tuple]] = None):
+        self.player = player
+        self.opponent = opponent
+        self.seed = seed
+        self.events: List[tuple] = [] if events is None else events
+
+    @property
+    def outcome(self) -> Optional[int]:
+        """ :returns the outcome of the battle, or None if it didn't finish """
+        if self.events and self.events[-1][0] == 'O':
+            return self.events[-1][1]
+        return None
+
+    @property
+    def actions(self) -> List[tuple]:
+        return [e for e in self.events if e[0] == 'A']
+
+    @property
+    def draws(self) -> List[tuple]:
+        return [e for e in self.events if e[0] == 'R']
+
+    def __eq__(self, other):
+        if not isinstance(other, ReplayLog):
+            return False
+        return (self.player, self.opponent, self.seed, self.events) == \
+               (other.player, other.opponent, other.seed, other.events)
+
+    def __repr__(self):
+        return f"ReplayLog({self.player}, {self.opponent}, seed={self.seed}, {len(self.events)} events)"
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(json.dumps([self.player, self.opponent, self.seed, self.events],
+                                        separators=(',', ':')).encode())
+
+    @staticmethod
+    def from_bytes(data: bytes) -> ReplayLog:
+        player, opponent, seed, events = json.loads(zlib.decompress(data))
+        # JSON turns tuples into lists, turn them back so that logs compare equal after a round trip
+        return ReplayLog(_tuples(player), _tuples(opponent), seed, [_tuples(e) for e in events])
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @staticmethod
+    def load(path: str) -> ReplayLog:
+        with open(path, 'rb') as f:
+            return ReplayLog.from_bytes(f.read())
+
+
+def _tuples(x):
+    return tuple(_tuples(i) for i in x) if isinstance(x, list) else x
+
+
+class RecordingRNG:
+    """ Makes random choices with its own random.Random and records each of them in a ReplayLog """
+
+    def __init__(self, log: ReplayLog, seed: Optional[int] = None):
+        self.log = log
+        self._random = random.Random(seed)
+
+    def randint(self, a: int, b: int) -> int:
+        result = self._random.randint(a, b)
+        self.log.events.append(('R', 'randint', a, b, result))
+        return result
+
+    def sample(self, population: Sequence, n: int) -> list:
+        indices = self._random.sample(range(len(population)), n)
+        self.log.events.append(('R', 'sample', len(population), n, tuple(indices)))
+        return [population[i] for i in indices]
+
+
+class ReplayRNG(RecordingRNG):
+    """ Makes the same random choices that were recorded in `source`, while recording them again into `log` """
+
+    def __init__(self, log: ReplayLog, source: ReplayLog):
+        super().__init__(log)
+        self._draws = iter(source.draws)
+
+    def _next(self, kind: str, *args):
+        draw = next(self._draws, None)
+        if draw is None or draw[1] != kind or draw[2:-1] != args:
+            raise ReplayError(f"Engine asked for {kind}{args} but the log has {draw}")
+        return draw[-1]
+
+    def randint(self, a: int, b: int) -> int:
+        result = self._next('randint', a, b)
+        self.log.events.append(('R', 'randint', a, b, result))
+        return result
+
+    def sample(self, population: Sequence, n: int) -> list:
+        indices = self._next('sample', len(population), n)
+        self.log.events.append(('R', 'sample', len(population), n, indices))
+        return [population[i] for i in indices]
+
+
+class ReplayError(Exception):
+    pass
+
+
+def _source_position(state: GameState, f: ActionFunc) -> Tuple[int, int]:
+    if f.source is None:
+        return -1, -1
+    for side, team in enumerate((state.player_team, state.opponent_team)):
+        for slot, a in enumerate(team):
+            if a is f.source:
+                return side, slot
+    if f.source.current_team is state.player_team:
+        return 0, -1
+    if f.source.current_team is state.opponent_team:
+        return 1, -1
+    return -1, -1
+
+
+@contextmanager
+def recording(state: GameState, log: ReplayLog, rng):
+    """ Record every action resolved on `state`, and every random choice made through `rng`, into `log` """
+    def record_action(s: GameState, f: ActionFunc):
+        side, slot = _source_position(s, f)
+        log.events.append(('A', f.trigger_name, side, slot, f.description, board_string(s)))
+
+    old_callback = state.step_callback
+    state.step_callback = record_action
+    try:
+        with using_rng(rng):
+            yield log
+    finally:
+        state.step_callback = old_callback
+
+
+def _run(player, opponent, seed, engine: Engine, make_rng: Callable[[ReplayLog], object]) -> ReplayLog:
+    log = ReplayLog(as_team_spec(player), as_team_spec(opponent), seed)
+    state = GameState(decode_team(log.player), decode_team(log.opponent))
+    with quiet(), recording(state, log, make_rng(log)):
+        outcome = engine(state)
+    log.events.append(('O', outcome, board_string(state)))
+    return log
+
+
+def record_battle(player: Union[Team, TeamSpec, Iterable], opponent: Union[Team, TeamSpec, Iterable],
+                  seed: Optional[int] = None, engine: Engine = reference_engine) -> ReplayLog:
+    """ Run a battle with `engine` and :returns its ReplayLog. The given teams are not modified """
+    return _run(player, opponent, seed, engine, lambda log: RecordingRNG(log, seed))
+
+
+def replay(log: ReplayLog, engine: Engine = reference_engine) -> ReplayLog:
+    """
+    Re-run the battle in `log` with `engine`, making the same random choices that were recorded, and :returns the
+    new log. Raises ReplayError if the engine asks for a random choice that doesn't match the recorded one
+    """
+    return _run(log.player, log.opponent, log.seed, engine, lambda new_log: ReplayRNG(new_log, log))
+
+
+def first_divergence(a: ReplayLog, b: ReplayLog) -> Optional[int]:
+    """ :returns the index of the first event that differs between the two logs, or None if they are identical """
+    for i, (x, y) in enumerate(zip(a.events, b.events)):
+        if x != y:
+            return i
+    if len(a.events) != len(b.events):
+        return min(len(a.events), len(b.events))
+    return None
+
+
+class Divergence:
+    """
+    The first point at which two engines disagreed on a battle. `index` is the position of the differing events in
+    the logs, or -1 if only the final events were compared. An event is None if that log had already ended
+    """
+
+    def __init__(self, log_a: ReplayLog, log_b: ReplayLog, index: int):
+        self.log_a = log_a
+        self.log_b = log_b
+        self.index = index
+
+    @property
+    def event_a(self) -> Optional[tuple]:
+        return self.log_a.events[self.index] if self.index < len(self.log_a.events) else None
+
+    @property
+    def event_b(self) -> Optional[tuple]:
+        return self.log_b.events[self.index] if self.index < len(self.log_b.events) else None
+
+    def __str__(self):
+        return f"{self.log_a.player} vs {self.log_a.opponent} (seed {self.log_a.seed}) diverged at event " + \
+               f"{self.index}:\n\t{self.event_a}\n\t{self.event_b}"
+
+
+def diff_engines(engine_a: Engine, engine_b: Engine, matchups: Iterable[Matchup],
+                 outcome_only: bool = False) -> List[Divergence]:
+    """
+    Run every (player, opponent, seed) matchup through both engines and :returns a Divergence for each battle where
+    their logs differ.
+
+    :param outcome_only: only compare the outcome and the final board. Use this for engines that are allowed to skip
+     over intermediate steps
+    """
+    divergences = []
+    for player, opponent, seed in matchups:
+        log_a = record_battle(player, opponent, seed, engine_a)
+        log_b = record_battle(player, opponent, seed, engine_b)
+        if outcome_only:
+            if log_a.events[-1] != log_b.events[-1]:
+                divergences.append(Divergence(log_a, log_b, -1))
+        elif (i := first_divergence(log_a, log_b)) is not None:
+            divergences.append(Divergence(log_a, log_b, i))
+    return divergences
@@ -0,0 +1,195 @@
+"""
+Persistent battle result cache, shared by every process and run that opens the same SQLite file.
+
+Entries are content addressed: the key is a hash of the engine version and a canonical JSON encoding of the
+matchup (both TeamSpecs and the seed). The engine version is a hash of the source of animals.py, data_structures.py
+and battle.py, so editing an ability, the rules that trigger it or the engines that run battles changes every key and
+old results are never returned. They are left to age out of the cache, or can be dropped right away with `purge_stale`.
+
+Only seeded matchups are cached, since an unseeded battle can end differently every time it is run.
+
+The cache holds at most `max_entries` results, and when it grows past that the least recently used entries are
+evicted. Lookups only read: the entries they hit are remembered and marked as used in the next write (put_many, or
+every `touch_batch` hits, or close), so readers don't take the write lock. WAL mode lets readers carry on while
+another process writes. The number of entries is kept in a meta table rather than counted on every write.
+"""
+from __future__ import annotations
+from typing import Optional, Sequence, List, Dict, Any
+from functools import lru_cache
+import hashlib
+import inspect
+import json
+import sqlite3
+import time
+
+import animals
+import battle
+import data_structures
+from battle import Matchup, as_team_spec, run_batch
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key BLOB PRIMARY KEY,
+    version TEXT NOT NULL,
+    result INTEGER NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta VALUES ('entries', (SELECT COUNT(*) FROM results));
+"""
+
+_CHUNK: int = 500
+""" Keys per SELECT ... IN (...), below SQLite's limit on the number of query parameters """
+
+
+@lru_cache(maxsize=None)
+def engine_version() -> str:
+    """ :returns a hash of the source of the ability definitions, the rules that run them and the battle engines """
+    digest = hashlib.sha256()
+    for module in (data_structures, animals, battle):
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()[:16]
+
+
+def matchup_key(matchup: Matchup, version: str) -> bytes:
+    player, opponent, seed = matchup
+    canonical = json.dumps([version, as_team_spec(player), as_team_spec(opponent), seed], separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).digest()
+
+
+class ResultCache:
+    """
+    Methods
+    -------
+    get_many:
+        look up a batch of matchups in one pass. Unknown (or unseeded) matchups are None
+
+    put_many:
+        store the results of a batch of matchups, evicting the least recently used entries if the cache is full
+
+    run_batch:
+        battle.run_batch that only simulates the matchups that aren't cached yet
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000000, version: Optional[str] = None, wal: bool = True,
+                 timeout: float = 60., touch_batch: int = 10000):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.path = path
+        self.max_entries = max_entries
+        self.version = version if version is not None else engine_version()
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        if wal:
+            self._db.execute('PRAGMA journal_mode=WAL')
+        if not self._has_schema():
+            self._db.executescript(_SCHEMA)
+        self.touch_batch = touch_batch
+        self._touched: Dict[bytes, float] = {}
+        """ key -> when it was last hit, for hits not yet written to the database """
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        if self._touched:
+            self._write()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _has_schema(self) -> bool:
+        """ Checked first so that opening an existing cache doesn't need the write lock """
+        try:
+            return self._db.execute("SELECT 1 FROM meta WHERE key = 'entries'").fetchone() is not None
+        except sqlite3.OperationalError:  # no meta table yet
+            return False
+
+    def __len__(self):
+        return self._db.execute("SELECT value FROM meta WHERE key = 'entries'").fetchone()[0]
+
+    def get(self, matchup: Matchup) -> Optional[int]:
+        return self.get_many([matchup])[0]
+
+    def put(self, matchup: Matchup, result: int):
+        self.put_many([matchup], [result])
+
+    def get_many(self, matchups: Sequence[Matchup]) -> List[Optional[int]]:
+        """ :returns the cached result of each matchup, or None for those that aren't cached """
+        keys = [matchup_key(m, self.version) if m[2] is not None else None for m in matchups]
+        wanted = [k for k in keys if k is not None]
+        found: Dict[bytes, int] = {}
+        for i in range(0, len(wanted), _CHUNK):
+            chunk = wanted[i:i + _CHUNK]
+            found.update(self._db.execute(f"SELECT key, result FROM results WHERE key IN "
+                                          f"({','.join('?' * len(chunk))})", chunk).fetchall())
+        if found:
+            now = time.time()
+            self._touched.update((k, now) for k in found)
+            if len(self._touched) >= self.touch_batch:
+                self._write()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return [found.get(k) if k is not None else None for k in keys]
+
+    def put_many(self, matchups: Sequence[Matchup], results: Sequence[int]):
+        """ Store the results of seeded matchups (unseeded ones are skipped) """
+        now = time.time()
+        self._write([(matchup_key(m, self.version), self.version, r, now) for m, r in zip(matchups, results)
+                     if m[2] is not None])
+
+    def _write(self, rows: Sequence[tuple] = ()):
+        """ Insert `rows`, write out pending hits and evict down to max_entries, all in one transaction """
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            # a key always maps to the same result, so an existing row only needs its last_used bumped
+            added = self._db.executemany('INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?)', rows).rowcount
+            touched = list(self._touched.items()) + [(row[0], row[3]) for row in rows]
+            self._db.executemany('UPDATE results SET last_used = ? WHERE key = ?', ((t, k) for k, t in touched))
+            entries = self._db.execute("SELECT value FROM meta WHERE key = 'entries'").fetchone()[0] + max(added, 0)
+            if entries > self.max_entries:
+                entries -= self._db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results '
+                                            'ORDER BY last_used LIMIT ?)', (entries - self.max_entries,)).rowcount
+            self._db.execute("UPDATE meta SET value = ? WHERE key = 'entries'", (entries,))
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+        self._touched.clear()
+
+    def missing(self, matchups: Sequence[Matchup]) -> List[int]:
+        """ :returns the indices of the matchups that still have to be simulated """
+        return [i for i, r in enumerate(self.get_many(matchups)) if r is None]
+
+    def run_batch(self, matchups: Sequence[Matchup], memoize: bool = False) -> List[int]:
+        """ Same as battle.run_batch, but only simulates (and then stores) the matchups that aren't cached """
+        results = self.get_many(matchups)
+        todo = [i for i, r in enumerate(results) if r is None]
+        if todo:
+            new = run_batch([matchups[i] for i in todo], memoize=memoize)
+            for i, r in zip(todo, new):
+                results[i] = r
+            self.put_many([matchups[i] for i in todo], new)
+        return results
+
+    def purge_stale(self) -> int:
+        """ Delete every entry made with a different engine version. :returns the number deleted """
+        self._db.execute('BEGIN IMMEDIATE')
+        deleted = self._db.execute('DELETE FROM results WHERE version != ?', (self.version,)).rowcount
+        self._db.execute("UPDATE meta SET value = value - ? WHERE key = 'entries'", (deleted,))
+        self._db.execute('COMMIT')
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0., 'version': self.version}
+
+
+def cached_run_batch(matchups: Sequence[Matchup], path: str, memoize: bool = False) -> List[int]:
+    """ ResultCache.run_batch on the cache at `path`. Top level so it can be sent to a process pool """
+    with ResultCache(path) as cache:
+        return cache.run_batch(matchups, memoize=memoize)
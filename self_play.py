@@ -0,0 +1,255 @@
+"""
+Full-run simulation: alternating shop phases and battles, turn after turn, until a game is won or lost.
+
+A Run tracks one game (turn, gold, lives, trophies and the team). Each turn it rolls a shop, runs the on_shop_start
+abilities, lets a policy buy, sell and roll, runs the on_shop_end abilities and then battles an opponent from an
+opponent source. run_games plays many independent seeded games across a process pool and streams one JSON line per
+game to a (optionally gzipped) trajectory file:
+
+    {"seed": 3, "won": false, "turns": [{"turn": 1, "actions": [["buy", 0, "Ant"], ...], "team": TeamSpec,
+     "opponent": TeamSpec, "result": 1, "gold": 1, "lives": 10, "trophies": 1}, ...]}
+"""
+from __future__ import annotations
+from typing import List, Optional, Iterator, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import json
+import os
+import random
+
+from battle import SPECIES, WIN, LOSS, encode_team, run_battle, quiet
+from data_structures import GameState, Team, Animal
+
+TURN_GOLD: int = 10
+BUY_COST: int = 3
+ROLL_COST: int = 1
+SELL_VALUE: int = 1
+STARTING_LIVES: int = 10
+TROPHIES_TO_WIN: int = 10
+MAX_TURNS: int = 50
+
+
+def shop_tier(turn: int) -> int:
+    """ :returns the highest rank of Animal available in the shop on `turn`. A new tier unlocks every 2 turns """
+    return min(6, (turn + 1) // 2)
+
+
+def shop_size(turn: int) -> int:
+    return 3 if turn < 5 else 4 if turn < 9 else 5
+
+
+def lives_lost(turn: int) -> int:
+    return 1 if turn <= 2 else 2 if turn <= 4 else 3
+
+
+class Run:
+    """
+    State of a single game between battles and during the shop phase
+
+    Attributes
+    ----------
+    state: GameState
+        the current shop phase. `state.player_team` is the player's team and `state.gold` the gold left to spend
+
+    actions: List[list]
+        the shop actions taken so far this turn, e.g. ["buy", 0, "Ant"], ["sell", 2, "Fish"] or ["roll"]
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.turn = 0
+        self.lives = STARTING_LIVES
+        self.trophies = 0
+        self.state = GameState(Team(), is_combat_phase=False, shop=[])
+        self.actions: List[list] = []
+
+    @property
+    def team(self) -> Team:
+        return self.state.player_team
+
+    @property
+    def gold(self) -> int:
+        return self.state.gold
+
+    @property
+    def shop(self) -> List[Animal]:
+        return self.state.shop
+
+    @property
+    def is_over(self) -> bool:
+        return self.lives <= 0 or self.trophies >= TROPHIES_TO_WIN or self.turn >= MAX_TURNS
+
+    def _fill_shop(self):
+        available = [cls for cls in SPECIES.values() if cls.rank <= shop_tier(self.turn)]
+        self.state.shop = [self.rng.choice(available)() for _ in range(shop_size(self.turn))]
+
+    def start_turn(self):
+        """ Start the next turn's shop phase """
+        self.turn += 1
+        self.actions = []
+        self.state.gold = TURN_GOLD
+        self._fill_shop()
+        for a in self.team.get_friends():
+            self.state.add_action(a.on_shop_start(), trigger_name='on_shop_start')
+        self.state.resolve()
+
+    def roll(self):
+        if self.gold < ROLL_COST:
+            raise ValueError("Not enough gold to roll")
+        self.state.gold -= ROLL_COST
+        self._fill_shop()
+        self.actions.append(['roll'])
+
+    def buy(self, shop_index: int, slot: Optional[int] = None):
+        """ Buy the Animal at `shop_index` and put it at position `slot` of the team, or the first empty one """
+        if self.gold < BUY_COST:
+            raise ValueError("Not enough gold to buy")
+        if len(self.team) >= Team.max_team_size:
+            raise ValueError("Team is full")
+        animal = self.shop.pop(shop_index)
+        self.state.gold -= BUY_COST
+        friends = self.team.get_friends()
+        friends.insert(len(friends) if slot is None else slot, animal)
+        animal.current_team = self.team
+        self.team.friends = friends
+        self.team.validate()
+        self.state.add_action(animal.on_buy(), trigger_name='on_buy')
+        for a in self.team.get_friends():
+            if a is not animal:
+                self.state.add_action(a.on_friend_bought(), trigger_name='on_friend_bought')
+        self.state.resolve()
+        self.actions.append(['buy', shop_index, animal.__class__.__name__])
+
+    def sell(self, slot: int):
+        animal = self.team[slot]
+        if animal is None:
+            raise ValueError(f"No Animal at position {slot}")
+        self.state.add_action(animal.on_sell(), trigger_name='on_sell')
+        self.state.resolve()
+        self.team[animal] = None
+        self.state.gold += SELL_VALUE * animal.level
+        self.actions.append(['sell', slot, animal.__class__.__name__])
+
+    def end_turn(self, opponent: Team) -> Dict[str, Any]:
+        """ End the shop phase, battle `opponent` and :returns this turn's trajectory entry """
+        for a in self.team.get_friends():
+            self.state.add_action(a.on_shop_end(), trigger_name='on_shop_end')
+        self.state.resolve()
+
+        # temporary buffs from the shop only last until the end of this battle, so battle a copy of the team
+        team, opponent_spec = encode_team(self.team), encode_team(opponent)
+        result = run_battle(team, opponent_spec, rng=self.rng)
+        for a in self.team.get_friends():
+            a.temp_attack = a.temp_health = 0
+        if result == WIN:
+            self.trophies += 1
+        elif result == LOSS:
+            self.lives -= lives_lost(self.turn)
+        return {'turn': self.turn, 'actions': self.actions, 'team': team, 'opponent': opponent_spec,
+                'result': result, 'gold': self.gold, 'lives': self.lives, 'trophies': self.trophies}
+
+
+class RandomPolicy:
+    """ Buys random Animals while it can afford to, and sometimes rolls or replaces its weakest Animal """
+
+    def __init__(self, roll_chance: float = 0.2, replace_chance: float = 0.3):
+        self.roll_chance = roll_chance
+        self.replace_chance = replace_chance
+
+    def play(self, run: Run):
+        rng = run.rng
+        while run.gold >= BUY_COST and run.shop:
+            if len(run.team) >= Team.max_team_size:
+                if rng.random() >= self.replace_chance:
+                    return
+                weakest = min(run.team.get_friends(), key=lambda a: a.current_attack + a.current_health)
+                run.sell(run.team[weakest])
+            if rng.random() < self.roll_chance and run.gold >= BUY_COST + ROLL_COST:
+                run.roll()
+            run.buy(rng.randrange(len(run.shop)))
+
+
+class RandomOpponents:
+    """ Random teams that grow in size and stats as the turns go on """
+
+    def get(self, turn: int, rng: random.Random) -> Team:
+        available = [cls for cls in SPECIES.values() if cls.rank <= shop_tier(turn)]
+        team = Team([rng.choice(available)() for _ in range(min(turn + 1, Team.max_team_size))])
+        for a in team.get_friends():
+            a.perma_buff(rng.randint(0, turn // 2), rng.randint(0, turn // 2))
+        return team
+
+
+class PoolOpponents:
+    """
+    Ghost opponents sampled from an opponent pool file (see opponent_pool.py) near the current turn, or from the
+    closest turn in the pool if there are none near it. The file is opened lazily so that instances can be sent to
+    worker processes
+    """
+
+    def __init__(self, path: str, turn_window: int = 1):
+        self.path = path
+        self.turn_window = turn_window
+        self._pool = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'turn_window': self.turn_window, '_pool': None}
+
+    def get(self, turn: int, rng: random.Random) -> Team:
+        if self._pool is None:
+            from opponent_pool import MappedOpponentPool
+            self._pool = MappedOpponentPool(self.path)
+        try:
+            return self._pool.sample_teams(1, turn, turn_window=self.turn_window, rng=rng)[0]
+        except LookupError:  # the pool doesn't cover this turn, so use the closest one it does
+            return self._pool.sample_teams(1, self._pool.nearest_turn(turn), rng=rng)[0]
+
+
+def play_game(seed: int, policy=None, opponents=None) -> Dict[str, Any]:
+    """ Play one full game and :returns its trajectory """
+    policy = policy if policy is not None else RandomPolicy()
+    opponents = opponents if opponents is not None else RandomOpponents()
+    run = Run(seed)
+    turns = []
+    with quiet():
+        while not run.is_over:
+            run.start_turn()
+            policy.play(run)
+            turns.append(run.end_turn(opponents.get(run.turn, run.rng)))
+    return {'seed': seed, 'won': run.trophies >= TROPHIES_TO_WIN, 'turns': turns}
+
+
+def _play(args) -> str:
+    seed, policy, opponents = args
+    return json.dumps(play_game(seed, policy, opponents), separators=(',', ':'))
+
+
+def _open(path: str, mode: str):
+    return gzip.open(path, mode + 't') if path.endswith('.gz') else open(path, mode)
+
+
+def run_games(num_games: int, path: str, seed: int = 0, max_workers: Optional[int] = None, policy=None,
+              opponents=None) -> Dict[str, Any]:
+    """
+    Play `num_games` games with seeds `seed`, `seed + 1`, ... across a process pool, appending one JSON line per game
+    to `path` as results come in (gzipped if `path` ends in .gz). :returns summary statistics
+    """
+    workers = max_workers or os.cpu_count() or 1
+    jobs = ((seed + i, policy, opponents) for i in range(num_games))
+    wins = turns = 0
+    with ProcessPoolExecutor(workers) as pool, _open(path, 'a') as f:
+        for line in pool.map(_play, jobs, chunksize=max(1, min(64, num_games // (4 * workers)))):
+            f.write(line + '\n')
+            game = json.loads(line)
+            wins += game['won']
+            turns += len(game['turns'])
+    return {'games': num_games, 'wins': wins, 'mean_turns': turns / num_games if num_games else 0.}
+
+
+def read_trajectories(path: str) -> Iterator[Dict[str, Any]]:
+    """ Stream the games written by run_games """
+    with _open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
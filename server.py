@@ -0,0 +1,225 @@
+"""
+Asyncio battle simulation service.
+
+Clients connect over TCP and send one JSON object per line:
+
+    {"id": 1, "player": TeamSpec, "opponent": TeamSpec, "seed": 123}   ->  {"id": 1, "result": 1}
+    {"id": 2, "op": "metrics"}                                          ->  {"id": 2, "metrics": {...}}
+
+Requests may be pipelined; responses are written as soon as they are ready and are matched up by "id". Concurrent
+requests (from any number of connections) are coalesced into micro-batches of at most `max_batch_size` battles,
+waiting at most `max_latency` seconds for a batch to fill, and each batch is run by a worker pool with
+battle.run_batch_isolated, so a battle that fails only fails its own request.
+"""
+from __future__ import annotations
+from typing import Optional, List, Tuple, Deque, Dict, Any
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+import argparse
+import asyncio
+import json
+import math
+import time
+
+from battle import run_batch_isolated, as_team_spec, decode_team, Matchup
+
+
+def percentile(values: List[float], q: float) -> float:
+    """ :returns the `q`th percentile (0-100) of `values` using the nearest-rank method, or 0 if it is empty """
+    if len(values) == 0:
+        return 0.
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+class SimulationServer:
+    """
+    Micro-batching battle server
+
+    Attributes
+    ----------
+    max_batch_size: int
+        most battles sent to the worker pool in one call
+
+    max_latency: float
+        most time in seconds the first request of a batch waits for more requests to arrive before dispatching
+
+    Methods
+    -------
+    start:
+        start listening and return the (host, port) actually bound. Use port 0 to pick any free port
+
+    submit:
+        evaluate a single matchup through the batcher without going through the socket
+
+    metrics:
+        queue depth, in-flight batches and p50/p99 end-to-end latency in milliseconds
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, max_batch_size: int = 64, max_latency: float = 0.005,
+                 executor: Optional[Executor] = None, max_workers: Optional[int] = None,
+                 latency_window: int = 10000):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if max_latency < 0:
+            raise ValueError("max_latency must not be negative")
+        self.host = host
+        self.port = port
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._owns_executor = executor is None
+        self._executor = executor if executor is not None else ProcessPoolExecutor(max_workers)
+        self._queue: Optional[asyncio.Queue] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._batcher_task: Optional[asyncio.Task] = None
+        self._dispatches: set = set()
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+        self._in_flight = 0
+        self._num_requests = 0
+        self._num_batches = 0
+
+    async def start(self) -> Tuple[str, int]:
+        self._queue = asyncio.Queue()
+        self._batcher_task = asyncio.create_task(self._batcher())
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        return self.host, self.port
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._batcher_task is not None:
+            self._batcher_task.cancel()
+            try:
+                await self._batcher_task
+            except asyncio.CancelledError:
+                pass
+        if self._dispatches:
+            await asyncio.gather(*self._dispatches, return_exceptions=True)
+        if self._owns_executor:
+            self._executor.shutdown()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def submit(self, player, opponent, seed: Optional[int] = None) -> int:
+        """ :returns WIN, DRAW or LOSS for `player` once the batch containing this matchup has been run """
+        future = asyncio.get_running_loop().create_future()
+        matchup: Matchup = (as_team_spec(player), as_team_spec(opponent), seed)
+        # reject bad teams here so the caller hears about them without waiting for a batch
+        decode_team(matchup[0]), decode_team(matchup[1])
+        await self._queue.put((matchup, future, time.perf_counter()))
+        return await future
+
+    def metrics(self) -> Dict[str, Any]:
+        latencies = list(self._latencies)
+        return {
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'in_flight': self._in_flight,
+            'requests': self._num_requests,
+            'batches': self._num_batches,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+        }
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # don't wait on the pool here so the next batch can start filling while this one runs
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Matchup, asyncio.Future, float]]):
+        self._in_flight += len(batch)
+        self._num_batches += 1
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, run_batch_isolated,
+                                                                       [m for m, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._in_flight -= len(batch)
+
+        done = time.perf_counter()
+        for (_, future, arrived), result in zip(batch, results):
+            self._latencies.append(done - arrived)
+            self._num_requests += 1
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        pending = set()
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(self._handle_line(line, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def _handle_line(self, line: bytes, writer: asyncio.StreamWriter):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            if request.get('op') == 'metrics':
+                response = {'id': request_id, 'metrics': self.metrics()}
+            else:
+                result = await self.submit(request['player'], request['opponent'], request.get('seed'))
+                response = {'id': request_id, 'result': result}
+        except Exception as e:
+            response = {'id': request_id, 'error': f"{e.__class__.__name__}: {e}"}
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+
+
+async def _serve(args):
+    server = SimulationServer(args.host, args.port, args.max_batch_size, args.max_latency / 1000,
+                              max_workers=args.workers)
+    host, port = await server.start()
+    print(f"Listening on {host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-latency', type=float, default=5., help='milliseconds')
+    parser.add_argument('--workers', type=int, default=None)
+    asyncio.run(_serve(parser.parse_args()))
@@ -0,0 +1,154 @@
+import random
+import pytest
+from battle import *
+
+
+def test_species_registry():
+    assert SPECIES['Fish'] is Fish
+    assert SPECIES['Ant'] is Ant
+    assert 'Animal' not in SPECIES
+
+
+def test_team_spec_round_trip():
+    t = Team([Fish(temp_attack=1), None, Ant(level=2)])
+    spec = encode_team(t)
+    assert spec == (('Fish', 2, 3, 1, 0, 1, 1), ('Ant', 2, 1, 0, 0, 1, 2))
+    assert decode_team(spec) == t
+    assert decode_team([list(a) for a in spec]) == t
+
+
+def test_as_team_spec():
+    spec = encode_team([Fish(), Sloth()])
+    assert as_team_spec(Team([Fish(), Sloth()])) == spec
+    assert as_team_spec([Fish(), None, Sloth()]) == spec
+    assert as_team_spec([list(a) for a in spec]) == spec
+
+
+def test_decode_unknown_species():
+    with pytest.raises(ValueError):
+        decode_team([('Dragon', 1, 1, 0, 0, 1, 1)])
+
+
+def test_run_battle_does_not_modify_teams():
+    t1, t2 = Team([Fish(), Ant()]), Team([Sloth(), Sloth()])
+    assert run_battle(t1, t2) == WIN
+    assert t1 == Team([Fish(), Ant()])
+    assert t2 == Team([Sloth(), Sloth()])
+
+
+def test_run_battle_seeded():
+    t1, t2 = encode_team([Ant(), Ant(), Sloth()]), encode_team([Ant(), Sloth(), Ant()])
+    assert [run_battle(t1, t2, seed) for seed in range(20)] == [run_battle(t1, t2, seed) for seed in range(20)]
+
+
+def test_run_batch():
+    t1, t2 = encode_team([Fish()]), encode_team([Sloth()])
+    assert run_batch([(t1, t2, None), (t2, t1, 1), (t1, t1, 2)]) == [WIN, LOSS, DRAW]
+
+
+def test_subgame_cache_hits():
+    cache = SubgameCache()
+    # both battles end with a Fish against two Sloths once the front animals have traded
+    assert cache(GameState([Pig(), Fish()], [Pig(), Sloth(), Sloth()])) == WIN
+    assert cache.hits == 0
+    state = GameState([Sloth(attack=3), Fish()], [Pig(), Sloth(), Sloth()])
+    player_team, opponent_team = state.player_team, state.opponent_team
+    assert cache(state) == WIN
+    assert state.player_team is player_team and state.opponent_team is opponent_team
+    assert cache.hits == 1
+    assert cache.hit_depths == {1: 1}
+    assert state.player_team == Team([Fish(temp_health=-2)])  # final board is restored from the cache
+    assert state.player_team[0].current_team is player_team
+    assert cache.stats()['hit_rate'] > 0
+
+
+def test_subgame_cache_skips_random_subgames():
+    cache = SubgameCache()
+    cache(GameState([Sloth()], [Sloth()]))  # attack tie needs a random choice
+    assert len(cache) == 0
+    cache(GameState([Fish()], [Sloth(), Sloth()]))
+    assert len(cache) == 2
+
+
+def test_subgame_cache_stores_forced_draws():
+    cache = SubgameCache()
+    # the Ant faints with no friends left, which is a draw with only one possible result
+    assert cache(GameState([Ant()], [Sloth(), Sloth()])) == LOSS
+    assert len(cache) > 0
+
+
+def test_subgame_cache_keeps_rng_state():
+    # the second battle reaches the first one's starting boards after one attack. The Ant then faints with one friend
+    # left, a draw with a single possible result that still advances the rng
+    teams = [([Ant(), Sloth(attack=2, health=5)], [Pig(health=20)]),
+             ([Fish(attack=1, health=1), Ant(), Sloth(attack=2, health=5)], [Sloth(), Pig(health=20)])]
+    cache = SubgameCache()
+    for player, opponent in teams:
+        reference, memoized = random.Random(7), random.Random(7)
+        expected = run_battle(encode_team(player), encode_team(opponent), rng=reference)
+        assert run_battle(encode_team(player), encode_team(opponent), rng=memoized, engine=cache) == expected
+        assert memoized.getstate() == reference.getstate()
+    assert cache.hit_depths == {1: 1}
+
+
+def test_subgame_cache_bounded():
+    cache = SubgameCache(maxsize=2)
+    cache(GameState([Fish(health=10)], [Sloth(), Sloth(), Sloth(), Sloth()]))
+    assert len(cache) == 2
+    cache.clear()
+    assert len(cache) == 0 and cache.hits == 0
+
+
+def test_memoized_battles_match_reference():
+    from replay import diff_engines, reference_engine
+    teams = [encode_team(t) for t in ([Ant(), Ant(), Sloth()], [Ant(), Sloth(), Ant()], [Fish(), Ant()],
+                                      [Pig(), Sloth(), Sloth()], [Sloth(), Fish(), Ant(), Pig()])]
+    cache = SubgameCache()
+    matchups = [(a, b, seed) for a in teams for b in teams for seed in range(5)]
+    assert diff_engines(reference_engine, cache, matchups, outcome_only=True) == []
+    assert cache.hits > 0
+    assert [run_battle(a, b, rng=random.Random(s), memoize=True) for a, b, s in matchups] == \
+           [run_battle(a, b, rng=random.Random(s)) for a, b, s in matchups]
+
+
+def test_is_ability_free():
+    assert is_ability_free(Sloth())
+    assert is_ability_free(Fish())  # only has a shop ability
+    assert is_ability_free(Pig())
+    assert not is_ability_free(Ant())
+
+
+def test_closed_form_combat():
+    state = GameState([Fish(health=10), Sloth()], [Sloth(attack=3, health=5), Pig()])
+    state.step_callback = lambda s, f: steps.append(f)
+    steps = []
+    assert closed_form_combat(state) == WIN
+    assert state.player_team == Team([Sloth()])
+    assert all(f.trigger_name == 'on_combat_start' for f in steps)
+
+
+def test_closed_form_falls_back_for_abilities():
+    state = GameState([Sloth(attack=2, health=5), Ant()], [Fish(health=10)])
+    state.step_callback = lambda s, f: steps.append(f)
+    steps = []
+    closed_form_combat(state)
+    assert any(f.trigger_name == 'do_attack' and f.source.name == 'Ant' for f in steps)
+    assert not any(f.trigger_name == 'do_attack' and f.source.name == 'Sloth' for f in steps)
+
+
+def test_closed_form_infinite_loop():
+    with pytest.raises(Exception):
+        closed_form_combat(GameState([Sloth(attack=0)], [Sloth(attack=0)]))
+
+
+def test_closed_form_matches_reference():
+    from replay import diff_engines, reference_engine
+    teams = [encode_team(t) for t in ([Ant(), Ant(), Sloth()], [Ant(), Sloth(), Ant()], [Fish(), Ant()],
+                                      [Pig(), Sloth(attack=2, health=9), Sloth()], [Sloth(), Fish(), Ant(), Pig()],
+                                      [Sloth(health=20)], [Fish(attack=1, health=12), Fish(health=7)])]
+    matchups = [(a, b, seed) for a in teams for b in teams for seed in range(5)]
+    assert diff_engines(reference_engine, closed_form_combat, matchups, outcome_only=True) == []
+    for a, b, seed in matchups:
+        r1, r2 = random.Random(seed), random.Random(seed)
+        assert run_battle(a, b, rng=r1) == run_battle(a, b, rng=r2, engine=closed_form_combat)
+        assert r1.random() == r2.random()  # same number of random choices were made
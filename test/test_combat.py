@@ -20,3 +20,34 @@ def test_gamestate_bad_init():
         state = GameState(Fish(), [Sloth(), Ant()])
     with pytest.raises(ValueError):
         state = GameState([Fish()], Sloth())
+
+
+def test_combat_draw():
+    state = GameState([Sloth()], [Sloth()])
+    assert state.do_combat() == 0
+    assert len(state.player_team) == 0
+    assert len(state.opponent_team) == 0
+
+
+def test_combat_win_and_loss():
+    assert GameState([Fish()], [Sloth()]).do_combat() == 1
+    assert GameState([Sloth()], [Fish()]).do_combat() == -1
+    assert GameState([Sloth(), Sloth()], []).do_combat() == 1
+
+
+def test_combat_last_ant_faints():
+    # Ant's faint ability has no friends left to buff
+    state = GameState([Ant()], [Sloth(), Sloth()])
+    assert state.do_combat() == -1
+    assert state.opponent_team == Team([Sloth()])
+
+
+def test_combat_shop_phase():
+    with pytest.raises(ValueError):
+        GameState([Fish()], is_combat_phase=False).do_combat()
+
+
+def test_gamestate_shop_init():
+    state = GameState([Fish()], is_combat_phase=False, shop=[Pig()])
+    assert state.opponent_team == Team()
+    assert state.shop == [Pig()]
@@ -208,6 +208,98 @@ def test_team_deep_copy():
         assert (x is not y) or (x is None and y is None)
 
 
+def test_team_shallow_copy_keeps_current_team():
+    t1 = Team([Fish(), Sloth()])
+    t2 = copy(t1)
+    assert all(a.current_team is t1 for a in t1.get_friends())
+    t2[0] = None
+    assert t1 == Team([Fish(), Sloth()])
+    assert t2 == Team([Sloth()])
+
+
+def test_animal_copy_keeps_level():
+    a = copy(Ant(level=3, rank=2))
+    assert a.level == 3
+    assert a.rank == 2
+
+
+# class TeamView
+def test_team_view_shares_animals():
+    base = Team([Fish(), Sloth(), Ant()])
+    view = TeamView(base)
+    assert view == base
+    assert all(x is y for x, y in zip(view, base))
+    assert not any(view.is_materialized(i) for i in range(3))
+
+
+def test_team_view_write():
+    base = Team([Fish(), Sloth(), Ant()])
+    view = TeamView(base)
+    view[1] = p = Pig()
+    assert view == Team([Fish(), Pig(), Ant()])
+    assert base == Team([Fish(), Sloth(), Ant()])
+    assert p.current_team is view
+    assert view.is_materialized(1)
+    view[0] = None
+    assert view == Team([Pig(), Ant()])
+    assert len(base) == 3
+
+
+def test_team_view_reorder_shared():
+    base = Team([Fish(), Ant(), Sloth()])
+    view = copy(base)
+    view[0] = view[2]
+    assert view == Team([Sloth(), Ant(), Sloth()])
+    assert view[0] is not base[2] and view.is_materialized(0)
+    assert base[2].current_team is base and not view.is_materialized(2)
+    view.temp_buff(0, 5, 5)
+    assert base == Team([Fish(), Ant(), Sloth()])
+    assert all(a.current_team is base for a in base.get_friends())
+
+
+def test_team_view_buff():
+    base = Team([Fish(), Sloth(), Ant()])
+    view = TeamView(base)
+    view.temp_buff(0, 1, 1)
+    view.perma_buff(view[2], 2, 2)
+    assert view == Team([Fish(temp_attack=1, temp_health=1), Sloth(), Ant(attack=4, health=3)])
+    assert base == Team([Fish(), Sloth(), Ant()])
+    assert view[0].current_team is view and view[2].current_team is view
+    assert view[1] is base[1] and base[1].current_team is base
+    assert view.materialize(0) is view[0]  # already private, not copied again
+
+
+def test_team_view_of_view():
+    base = Team([Fish(), Sloth()])
+    v1 = TeamView(base)
+    v1.temp_buff(0, 5, 5)
+    v2 = copy(v1)
+    assert isinstance(v2, TeamView)
+    assert v2[0] is v1[0]
+    v2.temp_buff(0, 1, 1)
+    assert v1[0].temp_attack == 5
+    assert v2[0].temp_attack == 6
+    assert base[0].temp_attack == 0
+
+
+def test_team_view_to_team():
+    base = Team([Fish(), Sloth()])
+    view = TeamView(base)
+    t = view.to_team()
+    assert type(t) is Team
+    assert t == base
+    assert all(a.current_team is t for a in t.get_friends())
+    assert all(a.current_team is base for a in base.get_friends())
+
+
+def test_team_view_in_gamestate():
+    base = Team([Fish(), Sloth()])
+    state = GameState(TeamView(base), [Sloth()])
+    assert all(state.player_team.is_materialized(a) for a in state.player_team.get_friends())
+    state.do_attack()
+    assert base == Team([Fish(), Sloth()])
+
+
 def test_team_validate_empty():
     t = Team()
     t.validate()
@@ -242,6 +334,59 @@ def test_team_validate_invalid():
         t1.validate()
 
 
+def test_team_validate_keeps_size():
+    t = Team([Fish(), Sloth(temp_health=-1), Ant()])
+    assert t.friends == [Fish(), Ant(), None, None, None]
+    t[0].temp_health = -10
+    t.validate()
+    assert t.friends == [Ant(), None, None, None, None]
+
+
+def test_team_init_does_not_modify_list():
+    friends = [None, Fish(), None]
+    t = Team(friends)
+    assert friends == [None, Fish(), None]
+    assert t.friends is not friends
+
+
+def test_animal_reset():
+    a = Ant(name='a', attack=5, health=6, temp_attack=1, temp_health=2, level=3)
+    a.current_team = Team()
+    a.reset()
+    assert_animal_values(a, 2, 1, 0, 0, 2, 1, 'Ant', 1, 1, None)
+    a.reset(Fish, health=10, temp_attack=1, level=2)
+    assert type(a) is Fish
+    assert_animal_values(a, 2, 10, 1, 0, 3, 10, 'Fish', 1, 2, None)
+    with pytest.raises(TypeError):
+        a.reset(Team)
+
+
+def test_team_reset():
+    t = Team([Fish(), Ant()])
+    friends = t.friends
+    t.reset([Sloth(), None, s := Sloth()])
+    assert t.friends is friends
+    assert t == Team([Sloth(), Sloth()])
+    assert s.current_team is t
+    t.reset()
+    assert t == Team()
+    with pytest.raises(ValueError):
+        t.reset([1])
+
+
+def test_gamestate_reset():
+    state = GameState([Fish()], [Ant()])
+    player = state.player_team
+    state.add_action(do_nothing(None))
+    state.reset([Sloth()], [Pig()])
+    assert state.player_team is player
+    assert state.player_team == Team([Sloth()])
+    assert state.opponent_team == Team([Pig()])
+    assert state.resolution_queue == []
+    state.reset(is_combat_phase=False, shop=[Fish()], gold=3)
+    assert not state.is_combat_phase and state.shop == [Fish()] and state.gold == 3
+
+
 def test_team_repr_and_str():
     # these might change later so this test is just for Coverage lol. doesn't matter too much anyway
     t = Team()
@@ -0,0 +1,73 @@
+import pytest
+from battle import *
+
+np = pytest.importorskip('numpy')
+from encoder import StateEncoder, benchmark, STATS
+
+
+def test_encode_combat_state():
+    enc = StateEncoder()
+    state = GameState([Fish(temp_attack=1), Ant(level=2)], [Sloth()])
+    x = enc.encode([state])
+    assert x.shape == (1, enc.feature_size)
+    row = x[0]
+    assert row[0] == 1
+    fish = enc.slot_offset(0)
+    assert row[fish + enc.species_index['Fish']] == 1
+    assert row[fish:fish + len(enc.species)].sum() == 1
+    assert list(row[fish + len(enc.species):fish + enc.slot_size]) == [2, 3, 1, 0, 1, 1]
+    ant = enc.slot_offset(1)
+    assert row[ant + len(enc.species) + STATS.index('level')] == 2
+    assert row[enc.slot_offset(2):enc.slot_offset(5)].sum() == 0
+    assert row[enc.slot_offset(5) + enc.species_index['Sloth']] == 1
+
+
+def test_encode_shop_state():
+    enc = StateEncoder(max_shop=3)
+    state = GameState([Fish()], is_combat_phase=False, shop=[Pig(), Ant()])
+    row = enc.encode([state])[0]
+    assert row[0] == 0
+    assert row[enc.slot_offset(10) + enc.species_index['Pig']] == 1
+    assert row[enc.slot_offset(11) + enc.species_index['Ant']] == 1
+    assert row[enc.slot_offset(12):].sum() == 0
+    with pytest.raises(ValueError):
+        enc.encode([GameState([], is_combat_phase=False, shop=[Pig()] * 4)])
+
+
+def test_encode_is_zero_copy_and_reuses_buffer():
+    enc = StateEncoder()
+    buffer = enc.allocate(8)
+    x = enc.encode([GameState([Fish()], [Ant()])] * 3)
+    assert np.shares_memory(x, buffer)
+    x = enc.encode([GameState([Sloth()], [])])
+    assert x.shape[0] == 1
+    assert buffer[1].any()  # stale rows beyond the batch are left alone
+    assert x[0, enc.slot_offset(0) + enc.species_index['Fish']] == 0
+
+
+def test_encode_into_out():
+    enc = StateEncoder()
+    out = np.zeros((4, enc.feature_size), dtype=np.float32)
+    x = enc.encode([GameState([Fish()], [Ant()])], out=out)
+    assert x.base is out
+    with pytest.raises(ValueError):
+        enc.encode([GameState([Fish()], [Ant()])] * 5, out=out)
+
+
+def test_decode_round_trip():
+    enc = StateEncoder()
+    states = [GameState([Fish(temp_attack=1), Ant(level=2), Pig()], [Sloth(), Fish(temp_health=-2)]),
+              GameState([Ant()], is_combat_phase=False, shop=[Pig(), Fish()])]
+    x = enc.encode(states)
+    for row, state in zip(x, states):
+        decoded = enc.decode(row)
+        assert decoded.is_combat_phase == state.is_combat_phase
+        assert decoded.player_team == state.player_team
+        if state.is_combat_phase:
+            assert decoded.opponent_team == state.opponent_team
+        else:
+            assert decoded.shop == state.shop
+
+
+def test_benchmark():
+    assert benchmark(num_states=64, batch_size=32) > 0
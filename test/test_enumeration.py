@@ -0,0 +1,76 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from itertools import permutations
+import random
+import pytest
+from battle import *
+from enumeration import *
+
+PLAYER = [Ant(), Ant(), Fish(), Sloth()]
+OPPONENT = [Sloth(), Ant(), Ant(), Fish()]
+
+
+def test_scripted_sample_covers_every_ordering():
+    orderings = set()
+    for c in range(12):
+        rng = ScriptedRNG((c,))
+        orderings.add(tuple(rng.sample('abcd', 2)))
+        assert rng.counts == [12] and rng.probability == Fraction(1, 12)
+    assert orderings == set(permutations('abcd', 2))
+    with pytest.raises(ValueError):
+        ScriptedRNG((12,)).sample('abcd', 2)
+
+
+def test_scripted_randint():
+    rng = ScriptedRNG((1,))
+    assert (rng.randint(0, 1), rng.randint(3, 5)) == (1, 3)
+    assert rng.path == [1, 0] and rng.probability == Fraction(1, 6)
+
+
+def test_deterministic_matchup():
+    probabilities, leaves, remaining = explore(encode_team([Fish()]), encode_team([Sloth(), Sloth()]))
+    assert probabilities == {WIN: 1} and leaves == 1 and remaining == []
+
+
+def test_sloth_tie():
+    probabilities, leaves, _ = explore(encode_team([Sloth()]), encode_team([Sloth()]))
+    assert probabilities == {DRAW: 1} and leaves == 2
+
+
+def test_explore_matches_sampling():
+    player, opponent = encode_team(PLAYER), encode_team(OPPONENT)
+    probabilities, leaves, remaining = explore(player, opponent)
+    assert sum(probabilities.values()) == 1 and not remaining and leaves > 10
+    counts = Counter(run_battle(player, opponent, rng=random.Random(i)) for i in range(3000))
+    for outcome, p in probabilities.items():
+        assert counts[outcome] / 3000 == pytest.approx(float(p), abs=0.04)
+
+
+def test_explore_resumes():
+    player, opponent = encode_team(PLAYER), encode_team(OPPONENT)
+    full, leaves, _ = explore(player, opponent)
+    merged, total, stack = {}, 0, [()]
+    while stack:
+        probabilities, n, stack = explore(player, opponent, stack, max_leaves=7)
+        for k, v in probabilities.items():
+            merged[k] = merged.get(k, 0) + v
+        total += n
+    assert merged == full and total == leaves
+
+
+def test_split():
+    player, opponent = encode_team(PLAYER), encode_team(OPPONENT)
+    paths, probabilities, leaves = split(player, opponent, 2)
+    assert paths and all(len(p) == 2 for p in paths)
+    assert split(player, opponent, 0) == ([()], {}, 0)
+
+
+def test_enumerate_outcomes_parallel():
+    full, leaves, _ = explore(encode_team(PLAYER), encode_team(OPPONENT))
+    with ProcessPoolExecutor(2) as pool:
+        result = enumerate_outcomes(PLAYER, OPPONENT, split_depth=2, max_leaves=10, executor=pool, max_workers=2)
+    assert result.probabilities == full
+    assert result.leaves == leaves
+    assert result.tasks > 2  # large subtrees were handed back and resubmitted
+    assert sum(result.probabilities.values()) == 1
@@ -0,0 +1,136 @@
+import random
+import pytest
+from battle import *
+from opponent_pool import OpponentPool, MappedOpponentPool, RECORD_SIZE
+
+
+def make_pool():
+    pool = OpponentPool(strength_bucket=5)
+    pool.add([Sloth()], 1)                                  # strength 2
+    pool.add([Fish(), Ant()], 1)                            # strength 8
+    pool.add(Team([Fish(temp_attack=2), Pig(level=2)]), 2)  # strength 11
+    pool.add([Ant(), Ant(), Ant()], 3)                      # strength 9
+    pool.add([Pig(rank=3), Sloth()], 3)                     # strength 6
+    return pool
+
+
+def test_pool_add():
+    pool = make_pool()
+    assert len(pool) == 5
+    assert pool.strength([Fish(), Ant()]) == 8
+    with pytest.raises(ValueError):
+        pool.add([('Dragon', 1, 1, 0, 0, 1, 1)], 1)
+
+
+def test_pool_sample_turn():
+    pool = make_pool()
+    entries = pool.sample(20, turn=2, rng=random.Random(0))
+    assert len(entries) == 20
+    assert all(e.team == encode_team([Fish(temp_attack=2), Pig(level=2)]) for e in entries)
+    assert entries[0].turn == 2
+    assert entries[0].total_stats == 11
+    assert entries[0].species == {'Fish', 'Pig'}
+    entries = pool.sample(50, turn=2, turn_window=1, rng=random.Random(0))
+    assert {e.turn for e in entries} == {1, 2, 3}
+    with pytest.raises(LookupError):
+        pool.sample(1, turn=10)
+    assert [pool.nearest_turn(t) for t in (0, 2, 10)] == [1, 2, 3]
+    with pytest.raises(LookupError):
+        OpponentPool().nearest_turn(1)
+
+
+def test_pool_sample_strength():
+    pool = make_pool()
+    entries = pool.sample(50, turn=1, strength=2, strength_window=0, rng=random.Random(0))
+    assert {e.total_stats for e in entries} == {2}
+    entries = pool.sample(50, turn=3, strength=9, strength_window=5, rng=random.Random(0))
+    assert {e.total_stats for e in entries} == {6, 9}
+
+
+def test_pool_sample_filters():
+    pool = make_pool()
+    entries = pool.sample(30, turn=2, turn_window=1, require_species=['Ant'], rng=random.Random(0))
+    assert all('Ant' in e.species for e in entries)
+    entries = pool.sample(30, turn=2, turn_window=1, exclude_species=['Ant', 'Fish'], rng=random.Random(0))
+    assert {e.team for e in entries} == {encode_team([Sloth()]), encode_team([Pig(rank=3), Sloth()])}
+    entries = pool.sample(30, turn=3, max_tier=2, rng=random.Random(0))
+    assert all(e.tiers[2:] == (0, 0, 0, 0) for e in entries)
+    with pytest.raises(LookupError):
+        pool.sample(1, turn=1, require_species=['Pig'])
+
+
+def test_pool_filters_use_groups():
+    pool = OpponentPool(strength_bucket=100)
+    for _ in range(500):
+        pool.add([Sloth(), Ant()], 1)
+    pool.add([Pig(), Ant()], 1)
+    pool.add([Pig(rank=4)], 1)
+    assert sorted(len(ids) for _, ids in pool._groups((1, 0))) == [1, 1, 500]
+    entries = pool.sample(50, turn=1, require_species=['Pig'], max_tier=2, rng=random.Random(0))
+    assert {e.team for e in entries} == {encode_team([Pig(), Ant()])}
+    entries = pool.sample(200, turn=1, exclude_species=['Sloth'], rng=random.Random(0))
+    assert {e.team for e in entries} == {encode_team([Pig(), Ant()]), encode_team([Pig(rank=4)])}
+    with pytest.raises(LookupError):
+        pool.sample(1, turn=1, require_species=['Fish'])
+
+
+def test_pool_stratified_filtered():
+    pool = OpponentPool()
+    for _ in range(99):
+        pool.add([Ant()], 1)
+    pool.add([Sloth()], 1)
+    pool.add([Pig(), Ant()], 2)
+    entries = pool.sample(1000, turn=1, turn_window=1, stratified=True, require_species=['Ant'],
+                          rng=random.Random(0))
+    # once filtered, each of the two buckets is drawn from equally often
+    assert 400 < sum(e.turn == 2 for e in entries) < 600
+
+
+def test_pool_stratified_and_weighted():
+    pool = OpponentPool()
+    for _ in range(99):
+        pool.add([Sloth()], 1)
+    pool.add([Pig()], 2)
+    rng = random.Random(1)
+    uniform = pool.sample(1000, turn=1, turn_window=1, rng=rng)
+    stratified = pool.sample(1000, turn=1, turn_window=1, stratified=True, rng=rng)
+    assert sum(e.turn == 2 for e in uniform) < 50
+    assert sum(e.turn == 2 for e in stratified) > 400
+    weighted = pool.sample(100, turn=1, turn_window=1, stratified=True, rng=rng,
+                           bucket_weight=lambda turn_distance, strength_distance: 0. if turn_distance else 1.)
+    assert all(e.turn == 1 for e in weighted)
+
+
+def test_pool_sample_states():
+    pool = make_pool()
+    states = pool.sample_states([Fish(), Fish()], 3, turn=1, strength_window=2, rng=random.Random(0))
+    assert len(states) == 3
+    assert states[0].player_team == Team([Fish(), Fish()])
+    assert states[0].player_team is not states[1].player_team
+    assert all(s.is_combat_phase for s in states)
+    assert all(s.opponent_team == Team([Fish(), Ant()]) for s in states)  # closest to the player's strength of 10
+
+
+def test_mapped_pool(tmp_path):
+    pool = make_pool()
+    path = str(tmp_path / 'pool.bin')
+    pool.save(path)
+    assert (tmp_path / 'pool.bin').stat().st_size > 5 * RECORD_SIZE
+    with MappedOpponentPool(path) as mapped:
+        assert len(mapped) == 5
+        for turn in (1, 2, 3):
+            expected = {e.team for e in pool.sample(200, turn=turn, rng=random.Random(turn))}
+            assert {e.team for e in mapped.sample(200, turn=turn, rng=random.Random(turn))} == expected
+        entries = mapped.sample(10, turn=3, require_species=['Pig'], rng=random.Random(0))
+        assert all(e.team == encode_team([Pig(rank=3), Sloth()]) for e in entries)
+        for kwargs in ({'exclude_species': ['Ant']}, {'max_tier': 1}, {'stratified': True}):
+            expected = {e.team for e in pool.sample(200, turn=1, turn_window=2, rng=random.Random(5), **kwargs)}
+            assert {e.team for e in mapped.sample(200, turn=1, turn_window=2, rng=random.Random(5), **kwargs)} == \
+                expected
+
+
+def test_mapped_pool_bad_file(tmp_path):
+    path = tmp_path / 'bad.bin'
+    path.write_bytes(b'not a pool file at all')
+    with pytest.raises(ValueError):
+        MappedOpponentPool(str(path))
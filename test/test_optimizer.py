@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from battle import *
+from optimizer import *
+
+POOL = [[Fish(), Ant(), Sloth()], [Pig(), Ant()], [Ant(), Ant(), Sloth()]]
+
+
+def make_optimizer(**kwargs):
+    return EvolutionaryOptimizer(POOL, population_size=8, elite=2, battles_per_opponent=2, stat_budget=15,
+                                 executor=ThreadPoolExecutor(1), **kwargs)
+
+
+def test_genomes_respect_constraints():
+    opt = make_optimizer()
+    genomes = [opt.random_genome() for _ in range(50)]
+    genomes += [opt.mutate(g) for g in genomes] + [opt.crossover(a, b) for a, b in zip(genomes, genomes[1:])]
+    for g in genomes:
+        assert 1 <= len(g) <= Team.max_team_size
+        assert total_stats(g) <= 15 or all(a[1] == a[2] == 1 for a in g)
+        assert all(a[0] in SPECIES and 1 <= a[6] <= MAX_LEVEL and a[1] >= 1 and a[2] >= 1 for a in g)
+        decode_team(g)
+
+
+def test_evaluate_early_stop():
+    battles = [(encode_team([Fish(attack=50, health=50)]), i) for i in range(10)]
+    assert evaluate_fixture(battles, threshold=0.) == (0., 10)
+    score, played = evaluate_fixture(battles, threshold=0.5)
+    assert played == 6  # after 6 losses, winning the other 4 can't reach 0.5
+    assert score == 0.
+
+
+def evaluate_fixture(battles, threshold):
+    from optimizer import _evaluate
+    return _evaluate(encode_team([Sloth()]), battles, 0, 0., threshold)
+
+
+def test_step_caches_and_reports():
+    with make_optimizer(seed=1) as opt:
+        first = opt.step()
+        assert first.battles > 0
+        assert first.dropped == 0
+        elites = opt.population[:2]
+        assert all(opt.fitness(e) is not None for e in elites)
+        second = opt.step()
+        assert second.cache_hits >= 2  # elites are never re-simulated
+        assert second.best_fitness >= first.best_fitness
+        opt.evolve(3)
+        assert len(opt.history) == 5
+        assert opt.generations_per_minute > 0
+        genome, fitness = opt.best
+        assert fitness == max(s.best_fitness for s in opt.history)
+
+
+def test_duplicates_dont_raise_threshold():
+    with make_optimizer() as opt:
+        total = len(opt.battles)
+        strong, weak, new = encode_team([Fish(attack=50, health=50)]), encode_team([Ant()]), encode_team([Sloth()])
+        opt._cache[strong] = (float(total), total)
+        opt._cache[weak] = (0., total)
+        # the weakest elite is `weak`, even though `strong` is in the population twice
+        opt.population = [strong, strong, weak, new]
+        stats = opt.step()
+        assert stats.dropped == 0
+        assert opt.fitness(new) is not None
+        assert all(opt.fitness(e) is not None for e in opt.population[:opt.elite])
+        assert stats.mean_fitness == pytest.approx((2 + opt.fitness(new)) / 4)
+
+
+def test_seeded():
+    with make_optimizer(seed=3) as a, make_optimizer(seed=3) as b:
+        assert [s.best for s in a.evolve(3)] == [s.best for s in b.evolve(3)]
+
+
+def test_bad_args():
+    with pytest.raises(ValueError):
+        EvolutionaryOptimizer([], executor=ThreadPoolExecutor(1))
+    with pytest.raises(ValueError):
+        EvolutionaryOptimizer(POOL, population_size=4, elite=4, executor=ThreadPoolExecutor(1))
+
+
+def test_process_pool():
+    with EvolutionaryOptimizer(POOL, population_size=4, elite=1, battles_per_opponent=1, max_workers=2) as opt:
+        assert opt.step().battles > 0
@@ -0,0 +1,61 @@
+import random
+import pytest
+from battle import *
+from pooling import BattlePool, run_batch_pooled, benchmark
+
+TEAMS = [encode_team(t) for t in ([Ant(), Ant(), Sloth()], [Ant(), Sloth(), Ant()], [Fish(), Ant(), Pig()],
+                                  [Pig(level=2), Sloth(temp_attack=2)], [Sloth(), Fish(), Ant(), Pig(), Ant()])]
+
+
+def test_pool_matches_run_battle():
+    pool = BattlePool()
+    for a in TEAMS:
+        for b in TEAMS:
+            for seed in range(3):
+                assert pool.run(a, b, rng=random.Random(seed)) == run_battle(a, b, rng=random.Random(seed))
+                assert pool.run(a, b, rng=random.Random(seed), engine=closed_form_combat) == \
+                       run_battle(a, b, rng=random.Random(seed))
+
+
+def test_pool_reuses_objects():
+    pool = BattlePool()
+    state = pool.load(TEAMS[0], TEAMS[4])
+    animals = [a for side in pool.animals for a in side]
+    assert state.player_team == decode_team(TEAMS[0])
+    assert state.opponent_team == decode_team(TEAMS[4])
+    assert all(any(a is b for b in animals) for a in state.player_team.get_friends())
+    pool.run(TEAMS[2], TEAMS[3])
+    assert pool.load([Fish()], [Sloth()]) is state
+    assert state.player_team == Team([Fish()])
+    assert state.player_team[0].current_team is state.player_team
+
+
+def test_pool_keeps_teams_on_subgame_hits():
+    pool = BattlePool()
+    cache = SubgameCache()
+    player_team, opponent_team = pool.state.player_team, pool.state.opponent_team
+    for _ in range(2):
+        assert pool.run([Pig(), Fish()], [Pig(), Sloth(), Sloth()], engine=cache) == WIN
+    assert cache.hits > 0
+    assert pool.state.player_team is player_team and pool.state.opponent_team is opponent_team
+    assert player_team == Team([Fish(temp_health=-2)])
+
+
+def test_pool_bad_team():
+    pool = BattlePool()
+    with pytest.raises(ValueError):
+        pool.load([('Dragon', 1, 1, 0, 0, 1, 1)], [])
+    with pytest.raises(ValueError):
+        pool.load([('Sloth', 1, 1, 0, 0, 1, 1)] * 6, [])
+
+
+def test_run_batch_pooled():
+    matchups = [(a, b, seed) for a in TEAMS for b in TEAMS for seed in range(2)]
+    assert run_batch_pooled(matchups) == run_batch(matchups)
+
+
+def test_benchmark():
+    results = benchmark(num_battles=50)
+    assert results['run_battle']['Animal_per_battle'] == 10
+    assert results['BattlePool'].get('Animal_per_battle', 0) == 0
+    assert results['BattlePool']['peak_bytes'] < results['run_battle']['peak_bytes']
@@ -0,0 +1,72 @@
+import random
+import pytest
+import data_structures
+from battle import *
+from replay import *
+
+ANTS = encode_team([Ant(), Ant(), Sloth(), Ant()])
+OTHER_ANTS = encode_team([Ant(), Fish(), Ant(), Ant()])
+
+
+def test_record_battle():
+    log = record_battle([Fish()], [Sloth()])
+    assert log.outcome == WIN
+    assert log.draws == []
+    assert log.actions[0] == ('A', 'on_combat_start', 0, 0, 'Do Nothing', 'Fish2/3|Sloth1/1')
+    assert ('A', 'do_attack', 1, 0, 'Take 2 damage', 'Fish2/2|Sloth1/1') in log.actions
+    assert ('A', 'on_faint', 1, -1, 'Remove corpse of Sloth', 'Fish2/2|') in log.actions
+    assert log.events[-1] == ('O', WIN, 'Fish2/2|')
+
+
+def test_record_battle_random_draws():
+    log = record_battle(ANTS, OTHER_ANTS, seed=3)
+    kinds = {d[1] for d in log.draws}
+    assert kinds == {'randint', 'sample'}
+    assert record_battle(ANTS, OTHER_ANTS, seed=3) == log
+
+
+def test_record_does_not_leak_hooks():
+    record_battle(ANTS, OTHER_ANTS, seed=1)
+    assert data_structures.rng is random
+
+
+def test_log_round_trip(tmp_path):
+    log = record_battle(ANTS, OTHER_ANTS, seed=5)
+    assert ReplayLog.from_bytes(log.to_bytes()) == log
+    log.save(str(tmp_path / 'log'))
+    assert ReplayLog.load(str(tmp_path / 'log')) == log
+    assert len(log.to_bytes()) < len(repr(log.events))
+
+
+def test_replay():
+    log = record_battle(ANTS, OTHER_ANTS, seed=7)
+    assert replay(log) == log
+    log.events = [e for e in log.events if e[0] != 'R'][:3]
+    with pytest.raises(ReplayError):
+        replay(log)
+
+
+def test_diff_engines_identical():
+    matchups = [(ANTS, OTHER_ANTS, seed) for seed in range(10)]
+    assert diff_engines(reference_engine, reference_engine, matchups) == []
+
+
+def cheating_engine(state):
+    # gives the player's front animal one extra health before the battle
+    state.player_team[0].temp_buff(0, 1)
+    return state.do_combat()
+
+
+def test_diff_engines_divergence():
+    divergences = diff_engines(reference_engine, cheating_engine, [([Fish()], [Sloth()], 0), ([Sloth()], [Fish()], 0)])
+    assert len(divergences) == 2
+    assert divergences[0].index == 0
+    assert divergences[0].event_a[-1] == 'Fish2/3|Sloth1/1'
+    assert divergences[0].event_b[-1] == 'Fish2/4|Sloth1/1'
+    assert 'diverged at event 0' in str(divergences[0])
+
+    divergences = diff_engines(reference_engine, cheating_engine, [([Fish()], [Sloth()], 0), ([Sloth()], [Fish()], 0)],
+                               outcome_only=True)
+    assert len(divergences) == 1  # the Sloth still loses with the same final board
+    assert divergences[0].event_a == ('O', WIN, 'Fish2/2|')
+    assert divergences[0].event_b == ('O', WIN, 'Fish2/3|')
@@ -0,0 +1,131 @@
+from concurrent.futures import ProcessPoolExecutor
+import sqlite3
+import pytest
+from battle import *
+from result_cache import *
+from work_queue import WorkQueue, matchup_space, worker
+
+TEAMS = [[Ant(), Ant(), Sloth()], [Fish(), Ant()], [Pig(), Sloth(), Sloth()]]
+MATCHUPS = list(matchup_space(TEAMS, TEAMS, seeds=range(2)))
+
+
+def test_engine_version():
+    assert engine_version() == engine_version()
+    key = matchup_key(MATCHUPS[0], engine_version())
+    assert key == matchup_key((TEAMS[0], Team(TEAMS[0]), 0), engine_version())
+    assert key != matchup_key(MATCHUPS[0], 'other')
+    assert key != matchup_key(MATCHUPS[1], engine_version())
+
+
+def test_get_and_put(tmp_path):
+    with ResultCache(str(tmp_path / 'c.db')) as cache:
+        assert cache.get_many(MATCHUPS) == [None] * len(MATCHUPS)
+        cache.put_many(MATCHUPS[:4], [WIN, LOSS, DRAW, WIN])
+        assert cache.get_many(MATCHUPS[:5]) == [WIN, LOSS, DRAW, WIN, None]
+        assert cache.missing(MATCHUPS[:6]) == [4, 5]
+        cache.put((TEAMS[0], TEAMS[1], None), WIN)  # unseeded matchups aren't cached
+        assert cache.get((TEAMS[0], TEAMS[1], None)) is None
+        assert len(cache) == 4
+
+
+def test_run_batch(tmp_path):
+    path = str(tmp_path / 'c.db')
+    expected = run_batch(MATCHUPS)
+    with ResultCache(path) as cache:
+        assert cache.run_batch(MATCHUPS[:5]) == expected[:5]
+    assert cached_run_batch(MATCHUPS, path) == expected
+    with ResultCache(path) as cache:
+        assert cache.run_batch(MATCHUPS) == expected
+        assert cache.stats()['hit_rate'] == 1
+
+
+def test_version_invalidates(tmp_path):
+    path = str(tmp_path / 'c.db')
+    with ResultCache(path, version='old') as cache:
+        cache.put_many(MATCHUPS, [WIN] * len(MATCHUPS))
+    with ResultCache(path) as cache:
+        assert cache.missing(MATCHUPS) == list(range(len(MATCHUPS)))
+        cache.put(MATCHUPS[0], LOSS)
+        assert cache.purge_stale() == len(MATCHUPS)
+        assert len(cache) == 1
+
+
+def test_lru_eviction(tmp_path):
+    with ResultCache(str(tmp_path / 'c.db'), max_entries=3) as cache:
+        for m in MATCHUPS[:3]:
+            cache.put(m, WIN)
+        cache.get(MATCHUPS[0])
+        cache.put(MATCHUPS[3], LOSS)
+        assert len(cache) == 3
+        assert cache.missing(MATCHUPS[:4]) == [1]
+    with pytest.raises(ValueError):
+        ResultCache(str(tmp_path / 'd.db'), max_entries=0)
+
+
+def test_concurrent_processes(tmp_path):
+    path = str(tmp_path / 'c.db')
+    chunks = [MATCHUPS[i::3] + MATCHUPS[:4] for i in range(3)]
+    with ProcessPoolExecutor(3) as pool:
+        results = list(pool.map(cached_run_batch, chunks, [path] * 3))
+    assert results == [run_batch(c) for c in chunks]
+    with ResultCache(path) as cache:
+        assert len(cache) == len(MATCHUPS)
+
+
+def test_worker_uses_cache(tmp_path):
+    queue, cache_path = str(tmp_path / 'q.db'), str(tmp_path / 'c.db')
+    with ResultCache(cache_path) as cache:
+        cache.put_many(MATCHUPS, [DRAW] * len(MATCHUPS))  # not the real results, so hits are visible
+    with WorkQueue(queue) as q:
+        q.add_sweep(MATCHUPS, shard_size=5)
+    worker(queue, cache_path=cache_path)
+    with WorkQueue(queue) as q:
+        assert [r for _, r in q.results()] == [DRAW] * len(MATCHUPS)
+
+
+def test_lookups_dont_take_the_write_lock(tmp_path):
+    path = str(tmp_path / 'c.db')
+    with ResultCache(path) as cache:
+        cache.put_many(MATCHUPS, [WIN] * len(MATCHUPS))
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    with ResultCache(path, timeout=0.1, touch_batch=len(MATCHUPS) + 1) as cache:
+        assert cache.get_many(MATCHUPS) == [WIN] * len(MATCHUPS)
+        writer.execute('COMMIT')
+    writer.close()
+
+
+def test_entry_count_is_tracked(tmp_path):
+    path = str(tmp_path / 'c.db')
+    with ResultCache(path, max_entries=5) as cache:
+        cache.put_many(MATCHUPS[:3], [WIN] * 3)
+        cache.put_many(MATCHUPS[:4], [WIN] * 4)  # 3 already there
+        assert len(cache) == 4
+        cache.put_many(MATCHUPS[4:8], [WIN] * 4)
+        assert len(cache) == 5
+    with ResultCache(path, version='new') as cache:
+        assert len(cache) == 5
+        assert cache.purge_stale() == 5
+        assert len(cache) == 0
+    db = sqlite3.connect(path)
+    assert db.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 0
+    db.close()
+
+
+def test_hits_are_written_in_batches(tmp_path):
+    path = str(tmp_path / 'c.db')
+    with ResultCache(path) as cache:
+        cache.put_many(MATCHUPS[:2], [WIN, WIN])
+
+    def last_used():
+        db = sqlite3.connect(path)
+        values = sorted(r[0] for r in db.execute('SELECT last_used FROM results'))
+        db.close()
+        return values
+
+    before = last_used()
+    with ResultCache(path, touch_batch=2) as cache:
+        cache.get(MATCHUPS[0])
+        assert last_used() == before
+        cache.get(MATCHUPS[1])  # second hit fills the batch
+        assert last_used() > before
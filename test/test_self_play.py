@@ -0,0 +1,108 @@
+import json
+import random
+import pytest
+from battle import *
+from opponent_pool import OpponentPool
+from self_play import *
+
+
+def test_schedule():
+    assert [shop_tier(t) for t in (1, 2, 3, 4, 11, 20)] == [1, 1, 2, 2, 6, 6]
+    assert [shop_size(t) for t in (1, 5, 9)] == [3, 4, 5]
+    assert [lives_lost(t) for t in (1, 3, 5)] == [1, 2, 3]
+
+
+def test_run_shop():
+    run = Run(seed=1)
+    run.start_turn()
+    assert run.turn == 1
+    assert run.gold == TURN_GOLD
+    assert len(run.shop) == shop_size(1)
+    run.buy(0)
+    assert len(run.team) == 1
+    assert run.team[0].current_team is run.team
+    assert len(run.shop) == shop_size(1) - 1
+    run.roll()
+    assert len(run.shop) == shop_size(1)
+    run.buy(1, slot=0)
+    assert len(run.team) == 2
+    run.sell(1)
+    assert len(run.team) == 1
+    assert [a[0] for a in run.actions] == ['buy', 'roll', 'buy', 'sell']
+    assert run.gold == TURN_GOLD - 2 * BUY_COST - ROLL_COST + SELL_VALUE + \
+           sum(a[2] == 'Pig' for a in run.actions if a[0] == 'buy')
+    with pytest.raises(ValueError):
+        run.sell(3)
+
+
+def test_pig_refund():
+    run = Run(seed=0)
+    run.start_turn()
+    run.state.shop = [Pig()]
+    run.buy(0)
+    assert run.gold == TURN_GOLD - BUY_COST + 1
+
+
+def test_run_not_enough_gold():
+    run = Run(seed=0)
+    run.start_turn()
+    run.state.gold = 2
+    with pytest.raises(ValueError):
+        run.buy(0)
+
+
+def test_end_turn():
+    run = Run(seed=0)
+    run.start_turn()
+    run.state.shop = [Fish()]
+    run.buy(0)
+    run.team[0].temp_buff(1, 1)
+    entry = run.end_turn(Team([Sloth()]))
+    assert entry['result'] == WIN
+    assert entry['team'] == encode_team([Fish(temp_attack=1, temp_health=1)])
+    assert run.team == Team([Fish()])  # shop temp buffs are gone after the battle
+    assert run.trophies == 1
+    entry = run.end_turn(Team([Fish(attack=10, health=10)]))
+    assert entry['result'] == LOSS
+    assert run.lives == STARTING_LIVES - lives_lost(1)
+
+
+def test_play_game_is_seeded():
+    game = play_game(3)
+    assert game == play_game(3)
+    assert game['turns'][-1]['lives'] <= 0 or game['won'] or len(game['turns']) == MAX_TURNS
+    assert [t['turn'] for t in game['turns']] == list(range(1, len(game['turns']) + 1))
+
+
+def test_pool_opponents(tmp_path):
+    pool = OpponentPool()
+    for turn in range(1, MAX_TURNS + 1):
+        pool.add([Sloth()], turn)
+    pool.save(str(tmp_path / 'pool.bin'))
+    opponents = PoolOpponents(str(tmp_path / 'pool.bin'))
+    assert opponents.get(3, random.Random(0)) == Team([Sloth()])
+    game = play_game(0, opponents=opponents)
+    assert all(t['opponent'] == encode_team([Sloth()]) for t in game['turns'])
+
+
+def test_pool_opponents_missing_turns(tmp_path):
+    pool = OpponentPool()
+    for turn in (1, 2, 3):
+        pool.add([Sloth(attack=turn)], turn)
+    pool.save(str(tmp_path / 'pool.bin'))
+    opponents = PoolOpponents(str(tmp_path / 'pool.bin'), turn_window=0)
+    assert opponents.get(10, random.Random(0)) == Team([Sloth(attack=3)])
+    game = play_game(0, opponents=opponents)
+    assert len(game['turns']) > 3
+    assert all(t['opponent'] == encode_team([Sloth(attack=min(t['turn'], 3))]) for t in game['turns'])
+
+
+@pytest.mark.parametrize('name', ['games.jsonl', 'games.jsonl.gz'])
+def test_run_games(tmp_path, name):
+    path = str(tmp_path / name)
+    summary = run_games(4, path, seed=10, max_workers=2)
+    games = list(read_trajectories(path))
+    assert summary['games'] == 4
+    assert [g['seed'] for g in games] == [10, 11, 12, 13]
+    assert summary['wins'] == sum(g['won'] for g in games)
+    assert games[1] == json.loads(json.dumps(play_game(11)))
@@ -0,0 +1,79 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from battle import *
+from server import SimulationServer, percentile
+
+
+def test_percentile():
+    assert percentile([], 50) == 0
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile(list(range(1, 101)), 99) == 99
+    assert percentile([5], 99) == 5
+
+
+async def _query(port, requests):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for r in requests:
+        writer.write(json.dumps(r).encode() + b'\n')
+    await writer.drain()
+    responses = [json.loads(await reader.readline()) for _ in requests]
+    writer.close()
+    return {r['id']: r for r in responses}
+
+
+def test_server_batches_concurrent_requests():
+    win, lose = encode_team([Fish()]), encode_team([Sloth()])
+
+    async def main():
+        async with SimulationServer(max_batch_size=8, max_latency=0.05,
+                                    executor=ThreadPoolExecutor(1)) as server:
+            requests = [{'id': i, 'player': win if i % 2 else lose, 'opponent': lose if i % 2 else win, 'seed': i}
+                        for i in range(16)]
+            responses = await _query(server.port, requests)
+            metrics = (await _query(server.port, [{'id': 'm', 'op': 'metrics'}]))['m']['metrics']
+            return responses, metrics
+
+    responses, metrics = asyncio.run(main())
+    assert all(responses[i]['result'] == (WIN if i % 2 else LOSS) for i in range(16))
+    assert metrics['requests'] == 16
+    assert metrics['batches'] < 16
+    assert metrics['queue_depth'] == 0
+    assert metrics['p99_ms'] >= metrics['p50_ms'] > 0
+
+
+def test_server_reports_errors():
+    async def main():
+        async with SimulationServer(executor=ThreadPoolExecutor(1)) as server:
+            return await _query(server.port, [{'id': 1, 'player': [['Dragon', 1, 1, 0, 0, 1, 1]], 'opponent': []},
+                                              {'id': 2, 'player': 'not a team'}])
+
+    responses = asyncio.run(main())
+    assert 'ValueError' in responses[1]['error']
+    assert 'error' in responses[2]
+
+
+def test_server_isolates_failing_battles():
+    stuck = [Sloth(attack=0)]
+
+    async def main():
+        async with SimulationServer(max_batch_size=8, max_latency=0.05, executor=ThreadPoolExecutor(1)) as server:
+            return await asyncio.gather(server.submit([Fish()], [Sloth()]), server.submit(stuck, stuck),
+                                        server.submit([Sloth(attack=-1)], [Fish()]),
+                                        server.submit([Fish()], [Pig()], seed=[1]), server.submit([Pig()], [Sloth()]),
+                                        return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert results[0] == WIN and results[4] == DRAW
+    assert 'did not complete' in str(results[1])
+    assert isinstance(results[2], ValueError)
+    assert isinstance(results[3], TypeError)
+
+
+def test_server_process_pool():
+    async def main():
+        async with SimulationServer(max_workers=1) as server:
+            return await asyncio.gather(*[server.submit([Fish()], [Sloth()], seed) for seed in range(4)])
+
+    assert asyncio.run(main()) == [WIN] * 4
@@ -0,0 +1,80 @@
+import random
+import pytest
+from battle import *
+from win_rate import *
+
+
+def test_wilson_interval():
+    assert wilson_interval(0, 0, 0.95) == (0, 1)
+    low, high = wilson_interval(50, 100, 0.95)
+    assert low == pytest.approx(0.404, abs=1e-3)
+    assert high == pytest.approx(0.596, abs=1e-3)
+    low, high = wilson_interval(0, 10, 0.95)
+    assert low == pytest.approx(0) and 0 < high < 0.35
+
+
+def test_counting_rng():
+    rng = CountingRNG(random.Random(0))
+    rng.randint(0, 1)
+    rng.sample([1, 2, 3], 2)
+    assert rng.draws == 2
+    # draws with only one possible result aren't counted
+    rng.randint(1, 1)
+    rng.sample([], 0)
+    rng.sample([1], 1)
+    assert rng.draws == 2
+
+
+def test_deterministic_matchup_with_lone_ant():
+    # the Ant faints with no friends left, so its ability samples from an empty team
+    for team_a, team_b in (([Ant()], [Sloth(), Sloth()]), ([Fish(), Ant()], [Pig(attack=3, health=9)]),
+                           ([Ant(), Fish()], [Fish(attack=3, health=4)])):
+        est = estimate_win_rate(team_a, team_b)
+        assert est.deterministic
+        assert est.runs == 1
+        assert est.low == est.high
+
+
+def test_deterministic_matchup():
+    est = estimate_win_rate([Fish()], [Sloth(), Sloth()])
+    assert est.deterministic
+    assert est.runs == 1
+    assert (est.win_rate, est.low, est.high) == (1, 1, 1)
+    est = estimate_win_rate([Fish()], [Pig()])
+    assert est.deterministic
+    assert est.draws == 1
+    assert (est.win_rate, est.low, est.high) == (0, 0, 0)
+
+
+def test_tied_attack_is_random():
+    # the outcome can't change, but the tie in get_priority is still a random choice
+    assert not estimate_win_rate([Sloth()], [Sloth()]).deterministic
+
+
+def test_random_matchup():
+    # tied attacks between the Ants make the order of faint abilities random
+    est = estimate_win_rate([Ant(), Ant(), Sloth()], [Ant(), Sloth(), Ant()], eps=0.05, seed=1)
+    assert not est.deterministic
+    assert est.runs > 10
+    assert (est.high - est.low) / 2 <= 0.05
+    assert est.low <= est.win_rate <= est.high
+    assert estimate_win_rate([Ant(), Ant(), Sloth()], [Ant(), Sloth(), Ant()], eps=0.05, seed=1).runs == est.runs
+
+
+def test_max_runs():
+    est = estimate_win_rate([Ant(), Ant(), Sloth()], [Ant(), Sloth(), Ant()], eps=0.001, max_runs=50)
+    assert est.runs == 50
+
+
+def test_bad_args():
+    with pytest.raises(ValueError):
+        estimate_win_rate([Fish()], [Sloth()], confidence=1)
+    with pytest.raises(ValueError):
+        estimate_win_rate([Fish()], [Sloth()], eps=0)
+
+
+def test_estimate_win_rates():
+    matchups = [([Fish()], [Sloth()]), ([Sloth()], [Fish()]), ([Ant(), Ant(), Sloth()], [Ant(), Sloth(), Ant()])]
+    estimates = estimate_win_rates(matchups, max_workers=2, eps=0.1)
+    assert [e.win_rate for e in estimates[:2]] == [1, 0]
+    assert estimates[2].runs == estimate_win_rate(*matchups[2], eps=0.1).runs
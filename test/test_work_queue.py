@@ -0,0 +1,144 @@
+import time
+import multiprocessing
+import pytest
+from battle import *
+from work_queue import WorkQueue, matchup_space, worker, run_workers
+
+TEAMS = [[Ant(), Ant(), Sloth()], [Fish(), Ant()], [Pig(), Sloth(), Sloth()]]
+
+
+def make_sweep(path, shard_size=4):
+    matchups = list(matchup_space(TEAMS, TEAMS, seeds=range(3)))
+    with WorkQueue(path) as q:
+        assert q.add_sweep(matchups, shard_size=shard_size) == -(-len(matchups) // shard_size)
+    return matchups
+
+
+def test_matchup_space():
+    matchups = list(matchup_space(TEAMS[:2], TEAMS, seeds=[1, 2]))
+    assert len(matchups) == 12
+    assert matchups[0] == (encode_team(TEAMS[0]), encode_team(TEAMS[0]), 1)
+
+
+def test_lease_and_complete(tmp_path):
+    path = str(tmp_path / 'q.db')
+    matchups = make_sweep(path)
+    with WorkQueue(path) as q:
+        shard_id, shard = q.lease('a')
+        assert shard == matchups[:4]
+        assert q.lease('b')[0] != shard_id
+        assert q.progress()['leased'] == 2
+        assert q.complete(shard_id, 'a', run_batch(shard))
+        assert not q.complete(shard_id, 'a', run_batch(shard))  # already done
+        assert list(q.results()) == list(zip(shard, run_batch(shard)))
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    path = str(tmp_path / 'q.db')
+    make_sweep(path, shard_size=100)
+    with WorkQueue(path, lease_seconds=0.01) as q:
+        shard_id, shard = q.lease('slow')
+        assert q.lease('fast') is None
+        time.sleep(0.02)
+        assert q.progress()['expired'] == 1
+        assert q.lease('fast')[0] == shard_id
+        assert not q.renew(shard_id, 'slow')
+        assert not q.complete(shard_id, 'slow', [0] * len(shard))
+        assert q.renew(shard_id, 'fast')
+        assert q.complete(shard_id, 'fast', run_batch(shard))
+        assert q.progress()['done'] == 1
+
+
+def test_progress(tmp_path):
+    path = str(tmp_path / 'q.db')
+    matchups = make_sweep(path)
+    with WorkQueue(path) as q:
+        p = q.progress()
+        assert (p['shards'], p['pending'], p['battles_remaining'], p['battles_per_second']) == (7, 7, 27, 0)
+        assert p['eta_seconds'] is None
+    assert worker(path, max_shards=2) == 2
+    with WorkQueue(path) as q:
+        p = q.progress()
+        assert p['done'] == 2 and p['battles_done'] == 8
+        assert p['battles_per_second'] > 0
+        assert p['eta_seconds'] > 0
+    worker(path)
+    with WorkQueue(path) as q:
+        p = q.progress()
+        assert p['battles_remaining'] == 0 and p['eta_seconds'] == 0
+        assert [m for m, _ in q.results()] == matchups
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / 'q.db')
+    matchups = make_sweep(path)
+    worker(path, max_shards=3)
+    assert worker(path) == 4
+    with WorkQueue(path) as q:
+        assert [r for _, r in q.results()] == run_batch(matchups)
+
+
+def test_multiple_processes(tmp_path):
+    path = str(tmp_path / 'q.db')
+    matchups = make_sweep(path, shard_size=1)
+    assert run_workers(path, 3) == len(matchups)
+    with WorkQueue(path) as q:
+        assert [r for _, r in q.results()] == run_batch(matchups)
+        attempts = q._db.execute('SELECT MAX(attempts) FROM shards').fetchone()[0]
+        assert attempts == 1
+
+
+def test_bad_shard_size(tmp_path):
+    with WorkQueue(str(tmp_path / 'q.db')) as q:
+        with pytest.raises(ValueError):
+            q.add_sweep([], shard_size=0)
+
+
+def test_failing_shard_is_skipped(tmp_path):
+    path = str(tmp_path / 'q.db')
+    stuck = encode_team([Sloth(attack=0)])
+    good = encode_team([Fish()])
+    with WorkQueue(path) as q:
+        q.add_sweep([(stuck, stuck, 0), (good, stuck, 0), (good, good, 0)], shard_size=1)
+    assert worker(path) == 2
+    with WorkQueue(path) as q:
+        p = q.progress()
+        assert (p['done'], p['failed'], p['pending'], p['battles_remaining']) == (2, 1, 0, 0)
+        assert p['eta_seconds'] == 0
+        (shard_id, error), = q.failures()
+        assert shard_id == 1 and 'did not complete' in error
+        assert [r for _, r in q.results()] == [WIN, DRAW]
+
+
+def test_expired_shard_fails_after_max_attempts(tmp_path):
+    path = str(tmp_path / 'q.db')
+    make_sweep(path, shard_size=100)
+    with WorkQueue(path, lease_seconds=0.01, max_attempts=2) as q:
+        for attempt in range(2):
+            assert q.lease(f'crashed{attempt}') is not None
+            time.sleep(0.02)
+        assert q.lease('next') is None
+        (_, error), = q.failures()
+        assert 'expired 2 times' in error
+        assert q.progress()['failed'] == 1
+    with pytest.raises(ValueError):
+        WorkQueue(path, max_attempts=0)
+
+
+def test_worker_renews_lease(tmp_path, monkeypatch):
+    path = str(tmp_path / 'q.db')
+    matchups = make_sweep(path, shard_size=100)
+    renewals = []
+    renew = WorkQueue.renew
+    monkeypatch.setattr(WorkQueue, 'renew', lambda self, *args: renewals.append(args) or renew(self, *args))
+    assert worker(path, renew_every=5) == 1
+    assert len(renewals) == (len(matchups) - 1) // 5
+
+
+def test_worker_gives_up_lost_lease(tmp_path, monkeypatch):
+    path = str(tmp_path / 'q.db')
+    make_sweep(path, shard_size=100)
+    monkeypatch.setattr(WorkQueue, 'renew', lambda self, *args: False)
+    assert worker(path, renew_every=5, max_shards=1) == 0
+    with WorkQueue(path) as q:
+        assert q.progress()['leased'] == 1
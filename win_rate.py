@@ -0,0 +1,126 @@
+"""
+Monte Carlo win rate estimation that runs only as many battles as it needs to.
+
+Battles are run in rounds of growing size until the Wilson score interval for the win rate is narrower than
++/- `eps` at the requested confidence, or `max_runs` battles have been run. A matchup whose first battle never hits a
+random choice (no tied attacks in get_priority, no get_random_friends) is deterministic, so it is stopped after one
+battle with an exact answer.
+"""
+from __future__ import annotations
+from typing import Optional, List, Tuple, Union, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+import math
+import os
+import random
+
+from battle import WIN, DRAW, LOSS, TeamSpec, CountingRNG, as_team_spec, run_battle
+from data_structures import Team
+
+
+def wilson_interval(successes: int, n: int, confidence: float) -> Tuple[float, float]:
+    """ :returns the Wilson score interval for a binomial proportion """
+    if n == 0:
+        return 0., 1.
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    p = successes / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0., centre - half_width), min(1., centre + half_width)
+
+
+class WinRateEstimate:
+    """
+    Result of estimate_win_rate
+
+    Attributes
+    ----------
+    win_rate: float
+        fraction of battles won by team_a. Draws count as not won
+
+    low, high: float
+        confidence interval for win_rate
+
+    wins, draws, losses: int
+        battle outcomes from the point of view of team_a
+
+    deterministic: bool
+        whether the matchup was found to involve no random choices, in which case `runs` is 1 and the interval is exact
+    """
+
+    def __init__(self, wins: int, draws: int, losses: int, low: float, high: float, deterministic: bool = False):
+        self.wins = wins
+        self.draws = draws
+        self.losses = losses
+        self.low = low
+        self.high = high
+        self.deterministic = deterministic
+
+    @property
+    def runs(self) -> int:
+        return self.wins + self.draws + self.losses
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.runs if self.runs else 0.
+
+    @property
+    def draw_rate(self) -> float:
+        return self.draws / self.runs if self.runs else 0.
+
+    def __repr__(self):
+        return f"WinRateEstimate({self.win_rate:.3f} in [{self.low:.3f}, {self.high:.3f}], " + \
+               f"{self.wins}/{self.draws}/{self.losses}{', deterministic' if self.deterministic else ''})"
+
+
+def estimate_win_rate(team_a: Union[Team, TeamSpec, Iterable], team_b: Union[Team, TeamSpec, Iterable],
+                      eps: float = 0.02, confidence: float = 0.95, seed: int = 0, min_runs: int = 10,
+                      max_runs: int = 100000) -> WinRateEstimate:
+    """
+    Estimate the probability that `team_a` beats `team_b`, running battles until the confidence interval is within
+    +/- `eps` of the estimate or `max_runs` battles have been run. Battle i uses seed `seed + i`, so the estimate is
+    reproducible.
+    """
+    if not 0 < confidence < 1:
+        raise ValueError("confidence must be between 0 and 1")
+    if eps <= 0:
+        raise ValueError("eps must be positive")
+    team_a, team_b = as_team_spec(team_a), as_team_spec(team_b)
+    counts = {WIN: 0, DRAW: 0, LOSS: 0}
+
+    rng = CountingRNG(random.Random(seed))
+    outcome = run_battle(team_a, team_b, rng=rng)
+    counts[outcome] += 1
+    if rng.draws == 0:
+        exact = 1. if outcome == WIN else 0.
+        return WinRateEstimate(counts[WIN], counts[DRAW], counts[LOSS], exact, exact, deterministic=True)
+
+    runs = 1
+    target = max(min_runs, 2)
+    while True:
+        while runs < target:
+            counts[run_battle(team_a, team_b, rng=random.Random(seed + runs))] += 1
+            runs += 1
+        low, high = wilson_interval(counts[WIN], runs, confidence)
+        if (high - low) / 2 <= eps or runs >= max_runs:
+            return WinRateEstimate(counts[WIN], counts[DRAW], counts[LOSS], low, high)
+        # check the stopping rule at geometrically spaced points, which bounds how often it is tested
+        target = min(int(runs * 1.5) + 1, max_runs)
+
+
+def _estimate(args) -> WinRateEstimate:
+    team_a, team_b, kwargs = args
+    return estimate_win_rate(team_a, team_b, **kwargs)
+
+
+def estimate_win_rates(matchups: Iterable[Tuple[Union[Team, TeamSpec, Iterable], Union[Team, TeamSpec, Iterable]]],
+                       max_workers: Optional[int] = None, **kwargs) -> List[WinRateEstimate]:
+    """
+    estimate_win_rate for every (team_a, team_b) pair, spread across a process pool. Keyword arguments are passed to
+    estimate_win_rate. :returns the estimates in the same order as `matchups`
+    """
+    jobs = [(as_team_spec(a), as_team_spec(b), kwargs) for a, b in matchups]
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_estimate, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
@@ -0,0 +1,293 @@
+"""
+Resumable work queue for simulation sweeps that span many processes and machines.
+
+A sweep is a list of (player, opponent, seed) matchups split into shards and stored in a SQLite database. Any number
+of workers, on any node that can open the database, repeatedly lease a shard, run its battles and commit the results.
+A lease that isn't completed (or renewed) within `lease_seconds` expires and the shard is handed to the next worker
+that asks, so crashed workers only cost the shards they were holding. Workers renew their lease between small
+groups of battles, so long shards aren't taken away from a worker that is still making progress. Committing checks
+that the worker still holds the lease, so a shard's results are only ever written once.
+
+A shard whose battles raise is marked 'failed' with the error, and a shard that has been leased `max_attempts` times
+without being completed (e.g. because it crashes every worker that takes it) is marked 'failed' instead of being
+handed out again, so one bad shard can't stall the sweep.
+
+Because everything lives in the database, a sweep can be stopped at any point and resumed by starting new workers.
+
+Use WAL mode (the default) when every worker runs on one machine. Over a shared filesystem, pass `wal=False`, since
+SQLite's WAL mode needs shared memory between the processes.
+"""
+from __future__ import annotations
+from typing import Optional, Iterable, List, Tuple, Iterator, Dict, Any, Sequence
+from contextlib import nullcontext
+from functools import partial
+from itertools import product
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+from battle import Matchup, as_team_spec, run_batch
+from result_cache import ResultCache
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    matchups TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    results TEXT,
+    error TEXT,
+    completed_at REAL
+);
+CREATE INDEX IF NOT EXISTS shards_status ON shards (status, lease_expires);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def matchup_space(players: Iterable, opponents: Iterable, seeds: Iterable[Optional[int]] = (None,)) \
+        -> Iterator[Matchup]:
+    """ :returns every (player, opponent, seed) combination, with teams converted to TeamSpecs """
+    opponents = [as_team_spec(o) for o in opponents]
+    seeds = list(seeds)
+    for player in players:
+        player = as_team_spec(player)
+        for opponent, seed in product(opponents, seeds):
+            yield player, opponent, seed
+
+
+def _to_json(matchups: Sequence[Matchup]) -> str:
+    return json.dumps(matchups, separators=(',', ':'))
+
+
+def _from_json(data: str) -> List[Matchup]:
+    return [(tuple(tuple(a) for a in p), tuple(tuple(a) for a in o), seed) for p, o, seed in json.loads(data)]
+
+
+class WorkQueue:
+    """
+    Methods
+    -------
+    add_sweep:
+        split matchups into shards and add them to the queue
+
+    lease:
+        take the next pending (or expired) shard for `owner`
+
+    complete:
+        atomically store the results of a leased shard
+
+    fail:
+        mark a leased shard as failed, with the error that stopped it
+
+    progress:
+        shard counts, global throughput in battles per second and an ETA
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300., wal: bool = True, timeout: float = 60.,
+                 max_attempts: int = 3):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # autocommit mode, so that transactions are only the explicit BEGIN IMMEDIATE ones below
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        if wal:
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+    def add_sweep(self, matchups: Iterable[Matchup], shard_size: int = 100) -> int:
+        """ Add `matchups` to the queue in shards of `shard_size` battles. :returns the number of shards added """
+        if shard_size < 1:
+            raise ValueError("shard_size must be at least 1")
+        shards = 0
+        batch: List[Matchup] = []
+        with self._transaction() as db:
+            for p, o, seed in matchups:
+                batch.append((as_team_spec(p), as_team_spec(o), seed))
+                if len(batch) == shard_size:
+                    db.execute('INSERT INTO shards (matchups, size) VALUES (?, ?)', (_to_json(batch), len(batch)))
+                    shards += 1
+                    batch = []
+            if batch:
+                db.execute('INSERT INTO shards (matchups, size) VALUES (?, ?)', (_to_json(batch), len(batch)))
+                shards += 1
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('created_at', ?)", (repr(time.time()),))
+        return shards
+
+    def lease(self, owner: str) -> Optional[Tuple[int, List[Matchup]]]:
+        """ :returns (shard id, matchups) for a shard now leased to `owner`, or None if there is nothing left to do """
+        now = time.time()
+        with self._transaction() as db:
+            db.execute("UPDATE shards SET status = 'failed', lease_expires = NULL, "
+                       "error = 'Lease expired ' || attempts || ' times' "
+                       "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, self.max_attempts))
+            row = db.execute("SELECT id, matchups FROM shards WHERE status = 'pending' "
+                             "OR (status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE shards SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                       "WHERE id = ?", (owner, now + self.lease_seconds, row[0]))
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('started_at', ?)", (repr(now),))
+        return row[0], _from_json(row[1])
+
+    def renew(self, shard_id: int, owner: str) -> bool:
+        """ Extend a lease that `owner` still holds. :returns False if the lease has been lost """
+        cursor = self._db.execute("UPDATE shards SET lease_expires = ? WHERE id = ? AND owner = ? "
+                                  "AND status = 'leased'", (time.time() + self.lease_seconds, shard_id, owner))
+        return cursor.rowcount == 1
+
+    def complete(self, shard_id: int, owner: str, results: Sequence[int]) -> bool:
+        """
+        Store the results of a shard leased to `owner`. :returns False, storing nothing, if the lease expired and the
+        shard was given to another worker
+        """
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE shards SET status = 'done', results = ?, completed_at = ?, "
+                                "lease_expires = NULL WHERE id = ? AND owner = ? AND status = 'leased'",
+                                (json.dumps(list(results)), time.time(), shard_id, owner))
+            return cursor.rowcount == 1
+
+    def fail(self, shard_id: int, owner: str, error: str) -> bool:
+        """ Mark a shard leased to `owner` as failed. :returns False, changing nothing, if the lease has been lost """
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE shards SET status = 'failed', error = ?, completed_at = ?, "
+                                "lease_expires = NULL WHERE id = ? AND owner = ? AND status = 'leased'",
+                                (error, time.time(), shard_id, owner))
+            return cursor.rowcount == 1
+
+    def failures(self) -> Iterator[Tuple[int, str]]:
+        """ :returns (shard id, error) for every failed shard """
+        yield from self._db.execute("SELECT id, error FROM shards WHERE status = 'failed' ORDER BY id")
+
+    def progress(self, window: float = 60.) -> Dict[str, Any]:
+        """
+        :returns shard counts by status, battles done and remaining, throughput in battles per second (over the last
+        `window` seconds, or since the sweep started if that is shorter) and the estimated seconds left
+        """
+        now = time.time()
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        battles = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        for status, n, size in self._db.execute('SELECT status, COUNT(*), SUM(size) FROM shards GROUP BY status'):
+            counts[status], battles[status] = n, size
+        expired = self._db.execute("SELECT COUNT(*) FROM shards WHERE status = 'leased' AND lease_expires < ?",
+                                   (now,)).fetchone()[0]
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'started_at'").fetchone()
+        started = float(row[0]) if row else now
+        since = max(started, now - window)
+        recent = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM shards WHERE status = 'done' "
+                                  "AND completed_at >= ?", (since,)).fetchone()[0]
+        throughput = recent / (now - since) if now > since else 0.
+        remaining = battles['pending'] + battles['leased']
+        return {'shards': sum(counts.values()), 'pending': counts['pending'], 'leased': counts['leased'],
+                'expired': expired, 'done': counts['done'], 'failed': counts['failed'], 'battles_done': battles['done'],
+                'battles_remaining': remaining, 'battles_per_second': throughput,
+                'eta_seconds': remaining / throughput if throughput > 0 else None if remaining else 0.}
+
+    def results(self) -> Iterator[Tuple[Matchup, int]]:
+        """ :returns every (matchup, result) that has been completed, in shard order """
+        for matchups, results in self._db.execute("SELECT matchups, results FROM shards WHERE status = 'done' "
+                                                  "ORDER BY id"):
+            yield from zip(_from_json(matchups), json.loads(results))
+
+
+class _Transaction:
+    """ BEGIN IMMEDIATE ... COMMIT, so that a lease is read and taken while holding the database's write lock """
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, *exc):
+        self.db.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _run_shard(queue: WorkQueue, shard_id: int, owner: str, matchups: List[Matchup], runner,
+               renew_every: int) -> Optional[List[int]]:
+    """ Run a shard `renew_every` battles at a time, renewing the lease in between. :returns None if it was lost """
+    results: List[int] = []
+    for start in range(0, len(matchups), renew_every):
+        if start and not queue.renew(shard_id, owner):
+            return None
+        results.extend(runner(matchups[start:start + renew_every]))
+    return results
+
+
+def worker(path: str, owner: Optional[str] = None, max_shards: Optional[int] = None, lease_seconds: float = 300.,
+           wal: bool = True, memoize: bool = False, cache_path: Optional[str] = None, renew_every: int = 10,
+           max_attempts: int = 3) -> int:
+    """
+    Lease, run and complete shards from the queue at `path` until it is empty or `max_shards` have been done. If
+    `cache_path` is given, results already in that ResultCache (see result_cache.py) aren't simulated again. A shard
+    that raises is marked as failed and the worker moves on to the next one.
+    :returns the number of shards this worker completed
+    """
+    owner = owner if owner is not None else default_owner()
+    done = 0
+    with WorkQueue(path, lease_seconds, wal, max_attempts=max_attempts) as queue, \
+            (ResultCache(cache_path, wal=wal) if cache_path is not None else nullcontext()) as cache:
+        runner = partial(cache.run_batch if cache is not None else run_batch, memoize=memoize)
+        while max_shards is None or done < max_shards:
+            leased = queue.lease(owner)
+            if leased is None:
+                break
+            shard_id, matchups = leased
+            try:
+                results = _run_shard(queue, shard_id, owner, matchups, runner, renew_every)
+            except Exception as e:
+                queue.fail(shard_id, owner, f"{e.__class__.__name__}: {e}")
+                continue
+            if results is not None and queue.complete(shard_id, owner, results):
+                done += 1
+    return done
+
+
+def run_workers(path: str, num_workers: Optional[int] = None, **kwargs) -> int:
+    """
+    Start `num_workers` worker processes on this machine and wait for them to finish. Run this on every node to work
+    through a sweep together. :returns the number of shards completed by these workers
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    with multiprocessing.Pool(num_workers) as pool:
+        jobs = [pool.apply_async(worker, (path,), kwargs) for _ in range(num_workers)]
+        return sum(job.get() for job in jobs)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Work through a simulation sweep, or report its progress')
+    parser.add_argument('path')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--progress', action='store_true')
+    args = parser.parse_args()
+    if args.progress:
+        with WorkQueue(args.path) as q:
+            print(q.progress())
+    else:
+        print(f"Completed {run_workers(args.path, args.workers)} shards")